@@ -0,0 +1,139 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import homework  # noqa: E402
+from outbox import Outbox  # noqa: E402
+from streaming import CHUNK_SIZE, HomeworkStream  # noqa: E402
+from tenant_state import TenantStateTable  # noqa: E402
+from tenants import Tenant  # noqa: E402
+
+COMMENT = (
+    'Хорошая работа, но стоит вынести константы в начало модуля, '
+    'добавить обработку исключений и покрыть тестами граничные случаи. '
+)
+
+
+def build_payload(homeworks: int, comment_repeats: int) -> bytes:
+    """Gzip-compressed response with a long homework history."""
+    body = json.dumps({
+        'homeworks': [
+            {
+                'id': number,
+                'status': 'rejected',
+                'homework_name': f'student__project_{number}.zip',
+                'reviewer_comment': COMMENT * comment_repeats,
+                'date_updated': '2022-04-15T06:12:40Z',
+                'lesson_name': f'Спринт {number}',
+            }
+            for number in range(homeworks)
+        ],
+        'current_date': 1650000000,
+    }, ensure_ascii=False).encode()
+    return gzip.compress(body)
+
+
+def decompressed_chunks(payload: bytes):
+    """Decompressed body in CHUNK_SIZE pieces, as iter_content yields it."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = payload
+    while data:
+        chunk = decompressor.decompress(data, CHUNK_SIZE)
+        data = decompressor.unconsumed_tail
+        if chunk:
+            yield chunk
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def buffered(payload: bytes) -> int:
+    """Whole body in memory, then response.json()."""
+    body = b''.join(decompressed_chunks(payload))
+    return len(json.loads(body)['homeworks'])
+
+
+def streamed(payload: bytes) -> int:
+    """Records parsed one at a time."""
+    return sum(1 for _ in HomeworkStream(decompressed_chunks(payload)))
+
+
+class PayloadResponse:
+    """Streamed response of the homework API with the given body."""
+
+    status_code = 200
+
+    def __init__(self, payload: bytes) -> None:
+        self.payload = payload
+
+    def iter_content(self, chunk_size: int = 1):
+        return decompressed_chunks(self.payload)
+
+    def close(self) -> None:
+        pass
+
+
+def polled(payload: bytes) -> int:
+    """The whole poll: check_updates staging every homework in the outbox."""
+    original_get = homework.requests.get
+    homework.requests.get = lambda *args, **kwargs: PayloadResponse(payload)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            outbox = Outbox(os.path.join(directory, 'outbox.sqlite3'))
+            states = TenantStateTable()
+            states.add('1', 0)
+            homework.check_updates(
+                None, states, outbox, Tenant('1', 'token', '1'),
+                outbox.clock
+            )
+            queued = outbox.connection.execute(
+                'SELECT COUNT(*) FROM messages'
+            ).fetchone()[0]
+            outbox.close()
+    finally:
+        homework.requests.get = original_get
+    return queued
+
+
+def measure(parse, payload: bytes) -> tuple:
+    """Records, peak traced memory and seconds of one parse."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    records = parse(payload)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return records, peak, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Peak memory of buffered and streamed response parsing.'
+    )
+    parser.add_argument('--homeworks', type=int, default=5000)
+    parser.add_argument('--comment-repeats', type=int, default=10)
+    args = parser.parse_args()
+    payload = build_payload(args.homeworks, args.comment_repeats)
+    size = len(b''.join(decompressed_chunks(payload)))
+    print(
+        f'body {size / 2 ** 20:.1f} MiB, '
+        f'gzip {len(payload) / 2 ** 20:.2f} MiB on the wire'
+    )
+    for name, parse in (
+        ('buffered', buffered),
+        ('streamed', streamed),
+        ('check_updates', polled),
+    ):
+        records, peak, elapsed = measure(parse, payload)
+        print(
+            f'{name}: {records} records, peak {peak / 2 ** 20:.1f} MiB, '
+            f'{elapsed:.3f} s'
+        )
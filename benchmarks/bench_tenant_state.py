@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tenant_state import TenantStateTable  # noqa: E402
+
+MESSAGE = (
+    'Homework verification status changed "{}__homework_bot.zip". '
+    'Работа проверена: у ревьюера есть замечания. Поправьте тесты.'
+)
+ERROR = 'Program crash: Error while requesting the server - {} timed out'
+
+
+def tenant_ids(count: int) -> list:
+    """Ids the tenants are registered under."""
+    return [str(100000000 + number) for number in range(count)]
+
+
+def build_dicts(ids: list) -> dict:
+    """Naive state: a dict of strings per tenant."""
+    return {
+        tenant_id: {
+            'current_timestamp': 1650000000 + number,
+            'last_status': 'rejected',
+            'last_message': MESSAGE.format(tenant_id),
+            'last_message_error': ERROR.format(tenant_id),
+        }
+        for number, tenant_id in enumerate(ids)
+    }
+
+
+def build_table(ids: list) -> TenantStateTable:
+    """Compact state table with the same content."""
+    states = TenantStateTable()
+    for number, tenant_id in enumerate(ids):
+        row = states.add(tenant_id, 1650000000 + number)
+        states.set_status(row, 'rejected')
+        states.set_message(row, MESSAGE.format(tenant_id))
+        states.set_error(row, ERROR.format(tenant_id))
+    return states
+
+
+def measure(build, ids: list) -> int:
+    """Bytes retained by the structure built from the given ids."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = build(ids)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del structure
+    return retained
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Memory per tenant of the poll state.'
+    )
+    parser.add_argument('--tenants', type=int, default=100000)
+    args = parser.parse_args()
+    ids = tenant_ids(args.tenants)
+    for name, build in (('dicts', build_dicts), ('table', build_table)):
+        retained = measure(build, ids)
+        print(
+            f'{name}: {retained / args.tenants:.1f} bytes per tenant '
+            f'({retained / 2 ** 20:.1f} MiB for {args.tenants} tenants)'
+        )
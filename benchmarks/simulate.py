@@ -0,0 +1,118 @@
+import argparse
+from array import array
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clock import SimulatedClock  # noqa: E402
+from scheduler import PollScheduler  # noqa: E402
+
+DAY = 24 * 60 * 60
+DEFAULT_SHARES = {
+    'reviewing': 0.05,
+    'active': 0.2,
+    'idle': 0.7,
+    'quarantined': 0.05,
+}
+
+
+def simulate(tenants: int, days: float, interval: float, latency: float,
+             concurrency: int, shares: dict, seed: int = 0) -> dict:
+    """Run the poll scheduler on simulated time with a model of the upstream.
+
+    Tenants are spread over the lanes by shares. Like poll_round, each of
+    concurrency workers takes the next due tenant as soon as it is free
+    and every poll takes latency simulated seconds, so the lag between due
+    and actual poll times shows whether the workers keep up with the given
+    number of tenants and which lanes wait.
+
+    Only the scheduler is real: homework.poll_round is not run, so the
+    adaptive limiter (the concurrency is fixed), the outbox writes and
+    delivery, and the lane changes after a poll are outside the model.
+    Workers freed at the same moment are refilled by one pop_due call, but
+    every poll still goes through the scheduler heap, so a simulated day
+    of 10000 tenants takes about 13 s of CPU time.
+    """
+    random.seed(seed)
+    clock = SimulatedClock(start=1650000000)
+    scheduler = PollScheduler(clock, interval)
+    lanes = list(shares)
+    weights = [shares[lane] for lane in lanes]
+    lane_of = {}
+    for number in range(tenants):
+        lane = random.choices(lanes, weights)[0]
+        lane_of[str(number)] = lane
+        scheduler.add(
+            str(number), delay=random.uniform(0, interval), lane=lane
+        )
+    end = clock.time() + days * DAY
+    polls = 0
+    lags = {lane: array('f') for lane in lanes}
+    started = time.perf_counter()
+    busy = []
+    while clock.time() < end:
+        now = clock.time()
+        while busy and busy[0] <= now:
+            heapq.heappop(busy)
+        due_tenants = scheduler.pop_due(concurrency - len(busy))
+        for tenant_id, due in due_tenants:
+            lags[lane_of[tenant_id]].append(now - due)
+            scheduler.reschedule(tenant_id, due)
+            heapq.heappush(busy, now + latency)
+        polls += len(due_tenants)
+        if len(busy) == concurrency:
+            wake = busy[0]
+        else:
+            wake = scheduler.next_due()
+            if wake is None:
+                wake = now + interval
+        clock.sleep(wake - now)
+    report = {
+        'tenants': tenants,
+        'simulated_days': days,
+        'polls': polls,
+        'upstream_requests_per_second': round(polls / (days * DAY), 3),
+    }
+    for lane, lane_lags in lags.items():
+        if not lane_lags:
+            continue
+        lane_lags = sorted(lane_lags)
+        report[f'{lane}_lag_p50_seconds'] = round(
+            statistics.median(lane_lags), 3
+        )
+        report[f'{lane}_lag_p99_seconds'] = round(
+            lane_lags[int(0.99 * (len(lane_lags) - 1))], 3
+        )
+    report['wall_seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Simulate polling on a virtual clock.'
+    )
+    parser.add_argument('--tenants', type=int, default=10000)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--interval', type=float, default=600)
+    parser.add_argument(
+        '--latency', type=float, default=0.3,
+        help='Seconds one API request takes.'
+    )
+    parser.add_argument('--concurrency', type=int, default=8)
+    for lane, share in DEFAULT_SHARES.items():
+        parser.add_argument(
+            f'--{lane}', type=float, default=share,
+            help=f'Share of tenants in the {lane} lane.'
+        )
+    args = parser.parse_args()
+    shares = {lane: getattr(args, lane) for lane in DEFAULT_SHARES}
+    print(json.dumps(simulate(
+        args.tenants, args.days, args.interval, args.latency,
+        args.concurrency, shares
+    )))
@@ -0,0 +1,30 @@
+import time
+
+
+class SystemClock:
+    """Wall clock of the running bot."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock:
+    """Clock whose sleep only moves the simulated time forward.
+
+    Lets the poll loop run hours or weeks of polling in moments. Only the
+    loop thread is expected to sleep, workers just read the time.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            self.now += seconds
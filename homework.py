@@ -1,22 +1,46 @@
+import contextlib
 import logging
 import os
 import sys
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from http import HTTPStatus
+from typing import Iterable, Iterator
 
 import requests
 import telegram
 from dotenv import load_dotenv
 
+import latency
+import metrics
+import profiling
+import replay
+from clock import SystemClock
+from limiter import AdaptiveLimiter
 from my_exception import EndpointError, SendMessageError, RequestError
+from outbox import Outbox, message_key
+from scheduler import PollScheduler
+from streaming import ACCEPT_ENCODING, CHUNK_SIZE, HomeworkStream
+from tenant_state import TenantStateTable
+from tenants import Tenant, TenantRegistry, diff_tenants
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 PRACTICUM_TOKEN = os.getenv('PRACTICUM_TOKEN')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+RECORD_FILE = os.getenv('RECORD_FILE')
+OUTBOX_FILE = os.getenv('OUTBOX_FILE', 'outbox.sqlite3')
+METRICS_FILE = os.getenv('METRICS_FILE')
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', 8))
+STAGE_SIZE = 100
 
 RETRY_TIME = 600
+REQUEST_TIMEOUT = (10, 30)
+RELOAD_INTERVAL = 30
+ACTIVE_PERIOD = 3 * 24 * 60 * 60
+QUARANTINE_FAILURES = 3
 
 HOMEWORK_VERDICTS = {
     'approved': 'Работа проверена: ревьюеру всё понравилось. Ура!',
@@ -24,40 +48,129 @@ HOMEWORK_VERDICTS = {
     'rejected': 'Работа проверена: у ревьюера есть замечания.'
 }
 
+upstream_limiter = AdaptiveLimiter(max_limit=UPSTREAM_MAX_CONCURRENCY)
+poll_pool = ThreadPoolExecutor(
+    max_workers=UPSTREAM_MAX_CONCURRENCY, thread_name_prefix='poll'
+)
+polls_in_flight = {}
 
-def send_message(bot: telegram.bot.Bot, message: str) -> None:
-    """The function of sending a message, we log the success and error of sending."""
+
+@profiling.stage_timer('send_message')
+def send_to_chat(bot: telegram.bot.Bot, chat_id: str, message: str) -> None:
+    """Sending a message to the given chat, we log the success of sending."""
     logger.debug('Trying to send a message to Telegram.')
     try:
-        bot.send_message(TELEGRAM_CHAT_ID, message)
+        bot.send_message(chat_id, message)
         logger.debug(f'Message "{message}", sent successfully')
     except Exception:
         raise SendMessageError('Error sending message to Telegram')
 
 
-def get_api_answer(current_timestamp: int) -> dict:
-    """We receive a response from the Yandex API, log a response other than 200."""
+def send_message(bot: telegram.bot.Bot, message: str) -> None:
+    """The function of sending a message, we log the success and error of sending."""
+    send_to_chat(bot, TELEGRAM_CHAT_ID, message)
+
+
+def error_message(response: requests.Response) -> str:
+    """Message of an error response, the reason when the body has none."""
+    try:
+        return response.text.split('\"')[-2]
+    except Exception:
+        return getattr(response, 'reason', None) or ''
+    finally:
+        response.close()
+
+
+def open_homeworks(token: str, current_timestamp: int,
+                   stream: bool = False) -> requests.Response:
+    """We send a request to the Yandex API, log a response other than 200."""
     timestamp = current_timestamp
-    headers = {'Authorization': f'OAuth {PRACTICUM_TOKEN}'}
+    headers = {
+        'Authorization': f'OAuth {token}',
+        'Accept-Encoding': ACCEPT_ENCODING,
+    }
     endpoint = 'https://practicum.yandex.ru/api/user_api/homework_statuses/'
     params = {'from_date': timestamp}
-    data = {'url': endpoint, 'headers': headers, 'params': params}
+    data = {
+        'url': endpoint,
+        'headers': headers,
+        'params': params,
+        'timeout': REQUEST_TIMEOUT,
+    }
+    if stream:
+        data['stream'] = True
     logger.debug('Sending a request to the Yandex server')
     try:
         response = requests.get(**data)
         if response.status_code != HTTPStatus.OK:
-            error_message = response.text.split('\"')[-2]
             raise EndpointError(
                 f'Эндпоинт https://practicum.yandex.ru/api/user_api/'
                 f'homework_statuses/ not available, '
-                f'error code - {response.status_code}. {error_message}'
+                f'error code - {response.status_code}. '
+                f'{error_message(response)}',
+                response.status_code
             )
         logger.debug('Received a response from the server')
     except Exception as error:
-        raise RequestError(f'Error while requesting the server - {error}')
-    return response.json()
+        raise RequestError(
+            f'Error while requesting the server - {error}'
+        ) from error
+    return response
+
+
+@profiling.stage_timer('get_api_answer')
+def request_homeworks(token: str, current_timestamp: int) -> dict:
+    """We receive a response from the Yandex API with the given token."""
+    return open_homeworks(token, current_timestamp).json()
 
 
+@contextlib.contextmanager
+def stream_homeworks(token: str, current_timestamp: int) -> Iterator[dict]:
+    """We receive homework records one by one, without buffering the body.
+
+    The request holds a slot of the upstream limiter until the response is
+    closed, but the limiter only gets the time of the request and of
+    reading the body, and only the errors of the request and the stream,
+    not of the work done on the records. The same times make up the
+    get_api_answer stage, parsing and checking the records the
+    check_response stage.
+    """
+    started = upstream_limiter.acquire()
+    start = time.perf_counter()
+    try:
+        response = open_homeworks(token, current_timestamp, stream=True)
+    except Exception as error:
+        upstream_limiter.release(started, error)
+        raise
+    opened = time.perf_counter() - start
+    body = profiling.TimedIterable(
+        response.iter_content(CHUNK_SIZE), always=True
+    )
+    records = profiling.TimedIterable(HomeworkStream(body))
+    upstream_error = None
+    try:
+        yield records
+    except requests.RequestException as error:
+        upstream_error = error
+        raise
+    finally:
+        response.close()
+        upstream_limiter.release(
+            started, upstream_error, opened + body.elapsed
+        )
+        if profiling.timers_enabled:
+            profiling.record_stage('get_api_answer', opened + body.elapsed)
+            profiling.record_stage(
+                'check_response', records.elapsed - body.elapsed
+            )
+
+
+def get_api_answer(current_timestamp: int) -> dict:
+    """We receive a response from the Yandex API, log a response other than 200."""
+    return request_homeworks(PRACTICUM_TOKEN, current_timestamp)
+
+
+@profiling.stage_timer('check_response')
 def check_response(response: dict) -> list:
     """We get from the response from the API, we log all surprises."""
     logger.debug('We start checking the response from the server.')
@@ -79,6 +192,7 @@ def check_response(response: dict) -> list:
     return homework
 
 
+@profiling.stage_timer('parse_status')
 def parse_status(homework: dict) -> str:
     """Parsing values, logging the absence of expected values."""
     homework_name = homework.get('homework_name')
@@ -99,49 +213,284 @@ def check_tokens() -> bool:
     return all([PRACTICUM_TOKEN, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID])
 
 
-def main() -> None:
-    """The main logic of the bot."""
+def collect_messages(states: TenantStateTable, row: int, tenant: Tenant,
+                     homeworks: Iterable[dict], outbox: Outbox) -> tuple:
+    """Stage the new notifications of the tenant, STAGE_SIZE at a time.
+
+    Repeats of the previous or the last sent message are skipped. Returns
+    the newest new message and the newest status, None when missing.
+    """
+    chunk = []
+    newest_message = None
+    newest = None
+    previous = None
+    for homework in homeworks:
+        message = parse_status(homework)
+        if newest is None:
+            newest = homework.get('status')
+        if message == previous or not states.is_new_message(row, message):
+            logger.debug(
+                'Received a repeat of the last message, '
+                'sending message canceled'
+            )
+        else:
+            if newest_message is None:
+                newest_message = message
+            chunk.append((
+                message_key(tenant.id, homework),
+                message,
+                latency.parse_date_updated(homework.get('date_updated')),
+            ))
+            if len(chunk) >= STAGE_SIZE:
+                outbox.stage(tenant.id, tenant.chat_id, chunk, tenant.group)
+                chunk = []
+        previous = message
+    if chunk:
+        outbox.stage(tenant.id, tenant.chat_id, chunk, tenant.group)
+    return newest_message, newest
+
+
+def report_failure(bot: telegram.bot.Bot, states: TenantStateTable,
+                   row: int, tenant: Tenant, error: Exception) -> None:
+    """Count a failed poll and send the error to the chat once."""
+    message = f'Program crash: {error}'
+    logger.error(message)
+    states.record_failure(row)
+    if not states.is_new_error(row, message):
+        logger.debug(
+            'Received a repeat of the last error message, '
+            'sending message canceled'
+        )
+        return
+    try:
+        send_to_chat(bot, tenant.chat_id, message)
+    except Exception as error:
+        logger.error(f'{error}')
+    states.set_error(row, message)
+
+
+def check_updates(bot: telegram.bot.Bot, states: TenantStateTable,
+                  outbox: Outbox, tenant: Tenant, clock) -> None:
+    """One polling iteration: request the API and queue the notifications.
+
+    Homeworks are parsed from the response as it streams in and staged in
+    the outbox in chunks, the cursor advances when they are released.
+    The next cursor is the current_date of the response, the time the
+    server built it, or the time of the request when it is missing, so
+    changes made while a long response is read are not skipped. Sending
+    is left to deliver_messages.
+    """
+    row = states.row(tenant.id)
+    try:
+        requested_at = int(clock.time())
+        with stream_homeworks(
+            tenant.practicum_token, states.cursors[row]
+        ) as homeworks:
+            message, newest = collect_messages(
+                states, row, tenant, homeworks, outbox
+            )
+        detected_at = clock.time()
+        if newest is None:
+            logger.debug('Missing new homework status.')
+        cursor = homeworks.extra.get('current_date')
+        if not isinstance(cursor, int):
+            cursor = requested_at
+        outbox.commit_staged(tenant.id, cursor, detected_at)
+        states.cursors[row] = cursor
+        states.failures[row] = 0
+        if newest is not None:
+            states.set_status(row, newest)
+        if message is not None:
+            states.changed_at[row] = int(detected_at)
+            states.set_message(row, message)
+    except Exception as error:
+        report_failure(bot, states, row, tenant, error)
+
+
+def deliver_messages(bot: telegram.bot.Bot, outbox: Outbox) -> None:
+    """Send the queued notifications, the failed ones stay for a retry.
+
+    Latencies of the delivered notifications go to the histograms.
+    """
+    try:
+        outbox.drain(
+            lambda chat_id, message: send_to_chat(bot, chat_id, message),
+            on_ack=lambda keys: latency.observe(outbox.delivered(keys))
+        )
+    except Exception as error:
+        logger.error(f'{error}')
+
+
+def choose_lane(states: TenantStateTable, row: int, now: float) -> str:
+    """Scheduler lane of a tenant by the result of its last polls."""
+    if states.failures[row] >= QUARANTINE_FAILURES:
+        return 'quarantined'
+    if states.status(row) == 'reviewing':
+        return 'reviewing'
+    if now - states.changed_at[row] < ACTIVE_PERIOD:
+        return 'active'
+    return 'idle'
+
+
+def start_polls(bot: telegram.bot.Bot, tenants: dict,
+                states: TenantStateTable, outbox: Outbox,
+                scheduler: PollScheduler, clock) -> None:
+    """Hand due tenants to the free workers.
+
+    Tenants are taken from the scheduler lanes only while the number of
+    polls in flight is under the upstream limit, so the waiting happens
+    in the lanes and shows in their lag.
+    """
+    while len(polls_in_flight) < int(upstream_limiter.limit):
+        due_tenants = scheduler.pop_due(
+            int(upstream_limiter.limit) - len(polls_in_flight)
+        )
+        if not due_tenants:
+            return
+        for tenant_id, due in due_tenants:
+            if tenant_id not in tenants:
+                continue
+            future = poll_pool.submit(
+                check_updates, bot, states, outbox, tenants[tenant_id], clock
+            )
+            polls_in_flight[future] = (tenant_id, due)
+
+
+def finish_polls(tenants: dict, states: TenantStateTable,
+                 scheduler: PollScheduler, clock, done: Iterable,
+                 deferred: list) -> None:
+    """Move the tenants of the finished polls to their lanes and reschedule.
+
+    Tenants removed while they were polled are dropped. A tenant that
+    would be due again at once, as with a zero interval, goes to deferred
+    instead, so that a round polls it only once.
+    """
+    now = clock.time()
+    for future in done:
+        tenant_id, due = polls_in_flight.pop(future)
+        if tenant_id not in tenants:
+            continue
+        lane = choose_lane(states, states.row(tenant_id), now)
+        scheduler.set_lane(tenant_id, lane)
+        if due + scheduler.interval > now:
+            scheduler.reschedule(tenant_id, due)
+        else:
+            deferred.append((tenant_id, due))
+
+
+def poll_round(bot: telegram.bot.Bot, tenants: dict,
+               states: TenantStateTable, outbox: Outbox,
+               scheduler: PollScheduler, clock) -> None:
+    """Poll the tenants that are due and deliver what was queued.
+
+    The poll pool workers take the next due tenant as soon as they finish
+    the previous one, so a slow tenant holds up only its own worker, and
+    every tenant is rescheduled as soon as its own poll is done. The round
+    ends when nothing is in flight or after RELOAD_INTERVAL; polls still
+    running then are collected by the next rounds, so the delivery and
+    the registry reload do not wait for the slowest poll.
+    """
+    deadline = clock.time() + RELOAD_INTERVAL
+    deferred = []
+    while True:
+        start_polls(bot, tenants, states, outbox, scheduler, clock)
+        timeout = deadline - clock.time()
+        if not polls_in_flight or timeout <= 0:
+            break
+        if len(polls_in_flight) < int(upstream_limiter.limit):
+            timeout = min(timeout, scheduler.time_to_next())
+        done, _ = wait(
+            polls_in_flight, timeout=timeout, return_when=FIRST_COMPLETED
+        )
+        finish_polls(tenants, states, scheduler, clock, done, deferred)
+    for tenant_id, due in deferred:
+        scheduler.reschedule(tenant_id, due)
+    deliver_messages(bot, outbox)
+    if METRICS_FILE:
+        metrics.write_textfile(METRICS_FILE)
+
+
+def apply_tenants(new_tenants: dict, tenants: dict,
+                  states: TenantStateTable, outbox: Outbox,
+                  scheduler: PollScheduler, clock) -> None:
+    """Apply registry changes, unchanged tenants keep their state and schedule.
+
+    Added tenants continue from their saved cursor and their first polls
+    are spread over RETRY_TIME.
+    """
+    added, removed, updated = diff_tenants(tenants, new_tenants)
+    for tenant_id in removed:
+        del tenants[tenant_id]
+        states.remove(tenant_id)
+        scheduler.remove(tenant_id)
+    for tenant in updated:
+        tenants[tenant.id] = tenant
+    for number, tenant in enumerate(added):
+        cursor = outbox.cursor(tenant.id)
+        if cursor is None:
+            cursor = int(clock.time()) - RETRY_TIME
+        tenants[tenant.id] = tenant
+        states.add(tenant.id, cursor)
+        scheduler.add(tenant.id, delay=number * RETRY_TIME / len(added))
+    if added or removed or updated:
+        logger.info(
+            f'Tenants added: {len(added)}, removed: {len(removed)}, '
+            f'updated: {len(updated)}'
+        )
+
+
+def main(clock=None) -> None:
+    """The main logic of the bot.
+
+    The loop, the scheduler and the outbox run on the given clock, the
+    system clock by default.
+    """
+    clock = clock or SystemClock()
     logger.debug('Start the bot...')
     bot = telegram.Bot(token=TELEGRAM_TOKEN)
-    current_timestamp = int(time.time()) - RETRY_TIME
-    last_message = None
-    last_message_error = None
-    if not check_tokens():
-        logger.critical('Error reading tokens.')
-        sys.exit('Error reading tokens.')
-    while True:
-        try:
-            response = get_api_answer(current_timestamp)
-            homework = check_response(response)
-            if homework:
-                message = parse_status(homework[0])
-                if message != last_message:
-                    send_message(bot, message)
-                    last_message = message
-                else:
-                    logger.debug(
-                        'Received a repeat of the last message, '
-                        'sending message canceled'
-                    )
-            else:
-                logger.debug('Missing new homework status.')
-            current_timestamp = int(time.time())
-        except Exception as error:
-            message = f'Program crash: {error}'
-            logger.error(message)
-            if message != last_message_error:
-                try:
-                    send_message(bot, message)
-                except Exception as error:
-                    logger.error(f'{error}')
-                last_message_error = message
-            else:
-                logger.debug(
-                    'Received a repeat of the last error message, '
-                    'sending message canceled'
+    if TENANTS_FILE:
+        registry = TenantRegistry(TENANTS_FILE)
+        registry.install_signal_handler()
+        if not TELEGRAM_TOKEN:
+            logger.critical('Error reading tokens.')
+            sys.exit('Error reading tokens.')
+    else:
+        registry = None
+        if not check_tokens():
+            logger.critical('Error reading tokens.')
+            sys.exit('Error reading tokens.')
+    outbox = Outbox(OUTBOX_FILE, clock)
+    outbox.prune()
+    tenants = {}
+    states = TenantStateTable()
+    scheduler = PollScheduler(clock, RETRY_TIME)
+    if not registry:
+        default_tenant = Tenant(
+            str(TELEGRAM_CHAT_ID), PRACTICUM_TOKEN, str(TELEGRAM_CHAT_ID)
+        )
+        apply_tenants(
+            {default_tenant.id: default_tenant},
+            tenants, states, outbox, scheduler, clock
+        )
+    profiling.install_signal_handlers()
+    recorder = replay.Recorder(RECORD_FILE) if RECORD_FILE else None
+    if recorder:
+        recorder.install(bot)
+    try:
+        deliver_messages(bot, outbox)
+        while True:
+            new_tenants = registry.check() if registry else None
+            if new_tenants is not None:
+                apply_tenants(
+                    new_tenants, tenants, states, outbox, scheduler, clock
                 )
-        finally:
-            time.sleep(RETRY_TIME)
+            poll_round(bot, tenants, states, outbox, scheduler, clock)
+            if not polls_in_flight:
+                clock.sleep(min(scheduler.time_to_next(), RELOAD_INTERVAL))
+    finally:
+        if recorder:
+            recorder.uninstall()
+        outbox.close()
 
 
 if __name__ == '__main__':
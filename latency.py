@@ -0,0 +1,134 @@
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Optional
+
+import metrics
+from outbox import Outbox
+
+STAGES = ('detect', 'enqueue', 'deliver', 'total')
+LATENCY_BUCKETS = (
+    10, 30, 60, 120, 300, 600, 900, 1800, 3600, 3 * 3600, 24 * 3600
+)
+SLO = 900
+SLO_PERCENTILE = 0.95
+DAY = 24 * 60 * 60
+
+notification_latency = metrics.histogram(
+    'notification_latency_seconds',
+    'Time from a homework status change to the notification, by stage: '
+    'detect (change to poll), enqueue (poll to outbox), deliver (outbox '
+    'to Telegram) and total.',
+    LATENCY_BUCKETS, ('group', 'stage')
+)
+
+
+def parse_date_updated(value: Optional[str]) -> Optional[float]:
+    """Timestamp of the date_updated field of a homework."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def stage_latencies(row: tuple) -> dict:
+    """Seconds spent in each stage by a delivered message row."""
+    _, _, updated_at, detected_at, created_at, delivered_at = row
+    latencies = {'deliver': delivered_at - created_at}
+    if detected_at is not None:
+        latencies['enqueue'] = created_at - detected_at
+        if updated_at is not None:
+            latencies['detect'] = detected_at - updated_at
+    if updated_at is not None:
+        latencies['total'] = delivered_at - updated_at
+    return latencies
+
+
+def observe(rows: list) -> None:
+    """Add delivered messages to the latency histograms."""
+    for row in rows:
+        group = row[1]
+        for stage, seconds in stage_latencies(row).items():
+            notification_latency.observe(seconds, group, stage)
+
+
+def percentile(values: list, share: float) -> float:
+    """Nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[max(0, int(share * len(ordered) + 0.5) - 1)]
+
+
+def report(rows: list, slo: float = SLO,
+           share: float = SLO_PERCENTILE) -> dict:
+    """Latency percentiles per group and tenants missing the SLO.
+
+    A tenant misses the SLO when the given percentile of its detect stage,
+    from the change upstream to the poll that saw it, exceeds slo seconds.
+    """
+    by_group = {}
+    by_tenant = {}
+    for row in rows:
+        tenant_id, group = row[0], row[1]
+        for stage, seconds in stage_latencies(row).items():
+            by_group.setdefault(group, {}).setdefault(stage, []).append(
+                seconds
+            )
+            by_tenant.setdefault((group, tenant_id), {}).setdefault(
+                stage, []
+            ).append(seconds)
+    groups = {
+        group: {
+            stage: {
+                'count': len(stages[stage]),
+                'p50': round(percentile(stages[stage], 0.5), 1),
+                f'p{round(share * 100)}': round(
+                    percentile(stages[stage], share), 1
+                ),
+            }
+            for stage in STAGES if stage in stages
+        }
+        for group, stages in sorted(by_group.items())
+    }
+    missing = []
+    for (group, tenant_id), stages in sorted(by_tenant.items()):
+        if 'detect' not in stages:
+            continue
+        detect = percentile(stages['detect'], share)
+        if detect > slo:
+            missing.append({
+                'tenant_id': tenant_id,
+                'group': group,
+                'notifications': len(stages['detect']),
+                'detect': round(detect, 1),
+                'total': round(percentile(stages['total'], share), 1),
+            })
+    return {'slo_seconds': slo, 'groups': groups, 'missing_slo': missing}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Notification latency report from the outbox.'
+    )
+    parser.add_argument('--outbox', default='outbox.sqlite3')
+    parser.add_argument(
+        '--slo', type=float, default=SLO,
+        help='Seconds from a status change to its detection.'
+    )
+    parser.add_argument(
+        '--percentile', type=float, default=SLO_PERCENTILE,
+        help='Share of notifications that must meet the SLO.'
+    )
+    parser.add_argument(
+        '--days', type=float, default=7,
+        help='Report the notifications delivered in the last days.'
+    )
+    args = parser.parse_args()
+    outbox = Outbox(args.outbox)
+    rows = outbox.delivered(since=time.time() - args.days * DAY)
+    outbox.close()
+    print(json.dumps(
+        report(rows, args.slo, args.percentile), indent=2, ensure_ascii=False
+    ))
@@ -0,0 +1,127 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+from http import HTTPStatus
+
+import requests
+
+import metrics
+from my_exception import EndpointError
+
+logger = logging.getLogger(__name__)
+
+
+def is_overload(error: Exception) -> bool:
+    """Check the error means the upstream is overloaded.
+
+    Timeouts, 429 and 5xx responses count as overload, the error chain is
+    followed because get_api_answer wraps them into RequestError.
+    """
+    while error is not None:
+        if isinstance(error, requests.Timeout):
+            return True
+        if isinstance(error, EndpointError) and error.status_code and (
+            error.status_code == HTTPStatus.TOO_MANY_REQUESTS
+            or error.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+        ):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class AdaptiveLimiter:
+    """Upstream concurrency limit adjusted by AIMD.
+
+    The limit grows by one per limit successful requests while the p95
+    latency and the error rate of the recent window stay under their
+    targets, and is multiplied by backoff on overload. Requests started
+    before the last cut do not cut it again.
+    """
+
+    def __init__(self, min_limit: int = 1, max_limit: int = 16,
+                 initial_limit: int = 2, latency_target: float = 2.0,
+                 error_target: float = 0.1, backoff: float = 0.5,
+                 window: int = 50) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit)
+        self.latency_target = latency_target
+        self.error_target = error_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.errors = collections.deque(maxlen=window)
+        self.last_cut = 0.0
+        self.condition = threading.Condition()
+        self.limit_gauge = metrics.gauge(
+            'upstream_concurrency_limit',
+            'Current limit of concurrent requests to the homework API.'
+        )
+        self.in_flight_gauge = metrics.gauge(
+            'upstream_in_flight',
+            'Requests to the homework API in progress.'
+        )
+        self.limit_gauge.set(int(self.limit))
+
+    def p95(self) -> float:
+        """95th percentile of the recent latencies."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def acquire(self) -> float:
+        """Wait for a free slot, returns the start time of the request."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.in_flight_gauge.set(self.in_flight)
+        return time.monotonic()
+
+    def release(self, started: float, error: Exception = None,
+                latency: float = None) -> None:
+        """Free the slot and adjust the limit by the request outcome.
+
+        The latency is the time the upstream took, by default all the time
+        since the slot was acquired.
+        """
+        if latency is None:
+            latency = time.monotonic() - started
+        with self.condition:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+            self.errors.append(error is not None)
+            if error is not None and is_overload(error):
+                if started >= self.last_cut:
+                    self.limit = max(
+                        self.min_limit, self.limit * self.backoff
+                    )
+                    self.last_cut = time.monotonic()
+                    logger.warning(
+                        f'Upstream overloaded, concurrency limit '
+                        f'cut to {int(self.limit)}'
+                    )
+            elif (
+                self.p95() <= self.latency_target
+                and sum(self.errors) <= self.error_target * len(self.errors)
+            ):
+                self.limit = min(
+                    self.max_limit, self.limit + 1 / int(self.limit)
+                )
+            self.limit_gauge.set(int(self.limit))
+            self.in_flight_gauge.set(self.in_flight)
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Run the block within the concurrency limit."""
+        started = self.acquire()
+        try:
+            yield
+        except Exception as error:
+            self.release(started, error)
+            raise
+        self.release(started)
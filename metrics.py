@@ -0,0 +1,121 @@
+import bisect
+import os
+import threading
+
+_registry = {}
+_lock = threading.Lock()
+
+
+class Gauge:
+    """Single value metric that can go up and down."""
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def collect(self) -> list:
+        """Exposition lines of the metric."""
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} gauge',
+            f'{self.name} {self.value}',
+        ]
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, by labels."""
+
+    def __init__(self, name: str, documentation: str, buckets: tuple,
+                 labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        self.series = {}
+        self.sums = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        """Count a value, labels are given in the order of labelnames."""
+        key = labels
+        with self.lock:
+            counts = self.series.get(key)
+            if counts is None:
+                counts = self.series[key] = [0] * (len(self.buckets) + 1)
+                self.sums[key] = 0.0
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sums[key] += value
+
+    def count(self, *labels) -> int:
+        """Number of observations with the given labels."""
+        return sum(self.series.get(labels, ()))
+
+    def collect(self) -> list:
+        """Exposition lines of the metric."""
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = {
+                key: (list(counts), self.sums[key])
+                for key, counts in self.series.items()
+            }
+        for key, (counts, total) in sorted(series.items()):
+            labels = [
+                f'{label}="{value}"'
+                for label, value in zip(self.labelnames, key)
+            ]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(
+                    f'{self.name}_bucket{{{bucket_labels}}} {cumulative}'
+                )
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+            lines.append(f'{self.name}_sum{suffix} {total}')
+        return lines
+
+
+def _register(name: str, create) -> object:
+    with _lock:
+        if name not in _registry:
+            _registry[name] = create()
+        return _registry[name]
+
+
+def gauge(name: str, documentation: str) -> Gauge:
+    """Registered gauge with the given name, created on first use."""
+    return _register(name, lambda: Gauge(name, documentation))
+
+
+def histogram(name: str, documentation: str, buckets: tuple,
+              labelnames: tuple = ()) -> Histogram:
+    """Registered histogram with the given name, created on first use."""
+    return _register(
+        name, lambda: Histogram(name, documentation, buckets, labelnames)
+    )
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format."""
+    with _lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path: str) -> None:
+    """Atomically write the metrics for the node exporter textfile collector."""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as metrics_file:
+        metrics_file.write(render())
+    os.replace(temporary, path)
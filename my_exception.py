@@ -7,7 +7,9 @@ class SendMessageError(Exception):
 
 
 class EndpointError(Exception):
-    pass
+    def __init__(self, message: str, status_code: int = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class RequestError(Exception):
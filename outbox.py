@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Callable, Iterable, Optional
+
+from clock import SystemClock
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+RETENTION = 7 * 24 * 60 * 60
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 60 * 60
+MAX_ATTEMPTS = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    key TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    tenant_group TEXT NOT NULL DEFAULT 'default',
+    updated_at REAL,
+    detected_at REAL,
+    next_attempt_at REAL,
+    staged INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_pending
+    ON messages (delivered_at, created_at);
+CREATE INDEX IF NOT EXISTS messages_staged
+    ON messages (tenant_id) WHERE staged = 1;
+CREATE TABLE IF NOT EXISTS cursors (
+    tenant_id TEXT PRIMARY KEY,
+    cursor INTEGER NOT NULL
+);
+'''
+ADDED_COLUMNS = {
+    'tenant_group': "TEXT NOT NULL DEFAULT 'default'",
+    'updated_at': 'REAL',
+    'detected_at': 'REAL',
+    'next_attempt_at': 'REAL',
+    'staged': 'INTEGER NOT NULL DEFAULT 0',
+}
+
+
+def message_key(tenant_id: str, homework: dict) -> str:
+    """Idempotency key of a notification about a homework status change."""
+    parts = (
+        tenant_id,
+        homework.get('id') or homework.get('homework_name'),
+        homework.get('status'),
+        homework.get('date_updated'),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class Outbox:
+    """Durable queue of notifications written before they are sent.
+
+    Messages and the tenant cursor are committed in one transaction, so
+    the cursor only advances past a homework once its notification is
+    safe on disk. Delivered messages stay for RETENTION seconds to drop
+    duplicates with the same key, together with the times the homework
+    changed, the change was detected, queued and delivered.
+
+    A message that fails to send is retried with an exponential backoff
+    and parked after MAX_ATTEMPTS, so it never holds up the others.
+
+    Long histories are written with stage() as they are parsed and
+    released with the cursor by commit_staged(), so a poll never holds
+    all its messages in memory.
+    """
+
+    def __init__(self, path: str, clock=None) -> None:
+        self.clock = clock or SystemClock()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self._migrate()
+            self.connection.executescript(SCHEMA)
+
+    def _migrate(self) -> None:
+        """Add the columns missing in outboxes of older versions."""
+        columns = {
+            row[1] for row in self.connection.execute(
+                'PRAGMA table_info(messages)'
+            )
+        }
+        if not columns:
+            return
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in columns:
+                self.connection.execute(
+                    f'ALTER TABLE messages ADD COLUMN {column} {definition}'
+                )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def cursor(self, tenant_id: str) -> Optional[int]:
+        """Saved cursor of the tenant, None for a new tenant."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT cursor FROM cursors WHERE tenant_id = ?',
+                (tenant_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, tenant_id: str, chat_id: str,
+                messages: Iterable[tuple], cursor: int,
+                detected_at: Optional[float] = None,
+                group: str = 'default') -> int:
+        """Store (key, text, updated_at) messages and advance the cursor.
+
+        updated_at is when the homework changed upstream, detected_at when
+        the poll saw it. Returns the number of messages that were not
+        queued before.
+        """
+        now = self.clock.time()
+        with self.lock, self.connection:
+            added = 0
+            for key, text, updated_at in messages:
+                added += self.connection.execute(
+                    'INSERT OR IGNORE INTO messages '
+                    '(key, tenant_id, chat_id, text, created_at, '
+                    'tenant_group, updated_at, detected_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        key, tenant_id, str(chat_id), text, now,
+                        group, updated_at, detected_at
+                    )
+                ).rowcount
+            self.connection.execute(
+                'INSERT INTO cursors (tenant_id, cursor) VALUES (?, ?) '
+                'ON CONFLICT (tenant_id) DO UPDATE SET cursor = excluded.cursor',
+                (tenant_id, cursor)
+            )
+        return added
+
+    def stage(self, tenant_id: str, chat_id: str, messages: Iterable[tuple],
+              group: str = 'default') -> int:
+        """Store (key, text, updated_at) messages hidden until commit_staged.
+
+        Messages staged by a poll that failed stay hidden and are released
+        by the next successful poll of the tenant, which stages the same
+        keys again. Returns the number of messages that were not stored
+        before.
+        """
+        now = self.clock.time()
+        with self.lock, self.connection:
+            return sum(
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO messages '
+                    '(key, tenant_id, chat_id, text, created_at, '
+                    'tenant_group, updated_at, staged) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, 1)',
+                    (
+                        key, tenant_id, str(chat_id), text, now,
+                        group, updated_at
+                    )
+                ).rowcount
+                for key, text, updated_at in messages
+            )
+
+    def commit_staged(self, tenant_id: str, cursor: int,
+                      detected_at: Optional[float] = None) -> int:
+        """Release the staged messages of the tenant and advance the cursor.
+
+        Returns the number of released messages.
+        """
+        now = self.clock.time()
+        with self.lock, self.connection:
+            released = self.connection.execute(
+                'UPDATE messages SET staged = 0, created_at = ?, '
+                'detected_at = ? WHERE tenant_id = ? AND staged = 1',
+                (now, detected_at, tenant_id)
+            ).rowcount
+            self.connection.execute(
+                'INSERT INTO cursors (tenant_id, cursor) VALUES (?, ?) '
+                'ON CONFLICT (tenant_id) DO UPDATE SET cursor = excluded.cursor',
+                (tenant_id, cursor)
+            )
+        return released
+
+    def pending(self, limit: int = BATCH_SIZE) -> list:
+        """Oldest messages due for delivery as (key, chat_id, text).
+
+        Messages of one poll go in the order the homeworks changed.
+        Staged messages, the ones waiting for their retry delay and parked
+        ones are skipped.
+        """
+        with self.lock:
+            return self.connection.execute(
+                'SELECT key, chat_id, text FROM messages '
+                'WHERE delivered_at IS NULL AND staged = 0 AND attempts < ? '
+                'AND (next_attempt_at IS NULL OR next_attempt_at <= ?) '
+                'ORDER BY created_at, updated_at, rowid LIMIT ?',
+                (MAX_ATTEMPTS, self.clock.time(), limit)
+            ).fetchall()
+
+    def parked(self) -> list:
+        """Messages given up after MAX_ATTEMPTS as (key, chat_id, text)."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT key, chat_id, text FROM messages '
+                'WHERE delivered_at IS NULL AND staged = 0 AND attempts >= ? '
+                'ORDER BY created_at, rowid',
+                (MAX_ATTEMPTS,)
+            ).fetchall()
+
+    def ack(self, keys: list) -> None:
+        """Mark messages as delivered."""
+        now = self.clock.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'UPDATE messages SET delivered_at = ? WHERE key = ?',
+                [(now, key) for key in keys]
+            )
+
+    def fail(self, key: str) -> int:
+        """Count a failed delivery attempt and delay the next one.
+
+        The delay doubles with every attempt up to MAX_RETRY_DELAY.
+        Returns the number of attempts made.
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT attempts FROM messages WHERE key = ?', (key,)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+            self.connection.execute(
+                'UPDATE messages SET attempts = ?, next_attempt_at = ? '
+                'WHERE key = ?',
+                (attempts, self.clock.time() + delay, key)
+            )
+        return attempts
+
+    def prune(self, retention: int = RETENTION) -> None:
+        """Drop delivered messages older than the retention period."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM messages WHERE delivered_at < ?',
+                (self.clock.time() - retention,)
+            )
+
+    def delivered(self, keys: Optional[list] = None,
+                  since: Optional[float] = None) -> list:
+        """Timings of delivered messages, by keys or delivered since a time.
+
+        Rows are (tenant_id, tenant_group, updated_at, detected_at,
+        created_at, delivered_at).
+        """
+        query = (
+            'SELECT tenant_id, tenant_group, updated_at, detected_at, '
+            'created_at, delivered_at FROM messages '
+            'WHERE delivered_at IS NOT NULL'
+        )
+        with self.lock:
+            if keys is not None:
+                placeholders = ', '.join('?' * len(keys))
+                return self.connection.execute(
+                    f'{query} AND key IN ({placeholders})', keys
+                ).fetchall()
+            return self.connection.execute(
+                f'{query} AND delivered_at >= ?', (since or 0,)
+            ).fetchall()
+
+    def drain(self, send: Callable, batch_size: int = BATCH_SIZE,
+              on_ack: Optional[Callable] = None) -> int:
+        """Send the due messages in batches until none are left.
+
+        send(chat_id, text) must raise on failure, the message is then
+        retried after its backoff and delivery goes on with the rest.
+        on_ack receives the keys of every acked batch. Returns the number
+        sent.
+        """
+        sent = 0
+        while True:
+            batch = self.pending(batch_size)
+            delivered = []
+            for key, chat_id, text in batch:
+                try:
+                    send(chat_id, text)
+                except Exception as error:
+                    attempts = self.fail(key)
+                    if attempts >= MAX_ATTEMPTS:
+                        logger.error(
+                            f'Message {key} to chat {chat_id} parked after '
+                            f'{attempts} attempts: {error}'
+                        )
+                    else:
+                        logger.warning(
+                            f'Message {key} to chat {chat_id} not '
+                            f'delivered, attempt {attempts}: {error}'
+                        )
+                    continue
+                delivered.append(key)
+            if delivered:
+                self.ack(delivered)
+                sent += len(delivered)
+                if on_ack:
+                    on_ack(delivered)
+            if len(batch) < batch_size:
+                return sent
@@ -0,0 +1,196 @@
+import collections
+import functools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', '.')
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', 30))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.01))
+TRACEMALLOC_TOP = 25
+
+timers_enabled = False
+stage_stats = collections.defaultdict(lambda: [0, 0.0, 0.0])
+_stats_lock = threading.RLock()
+_sampler_lock = threading.RLock()
+_sampler_running = False
+
+
+def record_stage(stage: str, elapsed: float) -> None:
+    """Add one call of the given duration to the stats of a stage."""
+    with _stats_lock:
+        stats = stage_stats[stage]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+
+def stage_timer(stage: str) -> Callable:
+    """Decorator measuring the duration of a bot stage while timers are on."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timers_enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class TimedIterable:
+    """Iterable adding up the time spent producing its items.
+
+    Lets a stage spread over a stream, such as reading a response body,
+    be timed apart from the work done on the items in between. Other
+    attributes are those of the wrapped iterable. Unless always is set,
+    the time is only added up while the timers are on.
+    """
+
+    def __init__(self, iterable: Iterable, always: bool = False) -> None:
+        self.iterable = iterable
+        self.always = always
+        self.elapsed = 0.0
+
+    def __getattr__(self, name: str):
+        return getattr(self.iterable, name)
+
+    def __iter__(self) -> Iterator:
+        if not (timers_enabled or self.always):
+            yield from self.iterable
+            return
+        iterator = iter(self.iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += time.perf_counter() - start
+            yield item
+
+
+def log_stage_stats() -> None:
+    """Write the collected stage timings to the log."""
+    with _stats_lock:
+        stats = sorted(
+            (stage, tuple(values)) for stage, values in stage_stats.items()
+        )
+    for stage, (count, total, longest) in stats:
+        logger.info(
+            f'Stage {stage}: calls {count}, '
+            f'avg {total / count * 1000:.2f} ms, '
+            f'max {longest * 1000:.2f} ms'
+        )
+
+
+def toggle_timers() -> None:
+    """Switch stage timers on or off, dumping the stats when switching off.
+
+    Runs in the SIGUSR2 handler, which may interrupt the main thread while
+    it holds the stats lock, so the locks are reentrant.
+    """
+    global timers_enabled
+    timers_enabled = not timers_enabled
+    if timers_enabled:
+        with _stats_lock:
+            stage_stats.clear()
+        logger.info('Stage timers enabled.')
+    else:
+        log_stage_stats()
+        logger.info('Stage timers disabled.')
+
+
+def _collapse(frame) -> list:
+    """Frames of a stack from the outermost one."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f'{code.co_name} '
+            f'({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+        )
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _sample(seconds: float, path: str) -> None:
+    """Sample the stacks of all threads and dump collapsed stacks.
+
+    Every stack starts with the name of its thread, so the pool workers
+    polling the tenants show up next to the main thread.
+    """
+    global _sampler_running
+    stacks = collections.Counter()
+    own_id = threading.get_ident()
+    tracemalloc.start()
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _collapse(frame)
+                if stack:
+                    thread_name = names.get(thread_id, thread_id)
+                    stacks[';'.join([str(thread_name)] + stack)] += 1
+            time.sleep(PROFILE_INTERVAL)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        with open(f'{path}.stacks', 'w') as stacks_file:
+            for stack, count in stacks.most_common():
+                stacks_file.write(f'{stack} {count}\n')
+        with open(f'{path}.memory', 'w') as memory_file:
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                memory_file.write(f'{stat}\n')
+        logger.info(f'Profile written to {path}.stacks and {path}.memory')
+    except Exception as error:
+        logger.error(f'Profiling failed: {error}')
+    finally:
+        tracemalloc.stop()
+        with _sampler_lock:
+            _sampler_running = False
+
+
+def start_sampling(seconds: float = PROFILE_SECONDS) -> bool:
+    """Start profiling all threads in the background for N seconds."""
+    global _sampler_running
+    with _sampler_lock:
+        if _sampler_running:
+            logger.warning('Profiler is already running.')
+            return False
+        _sampler_running = True
+    path = os.path.join(
+        PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S')
+    )
+    logger.info(f'Profiling for {seconds} seconds.')
+    threading.Thread(
+        target=_sample,
+        args=(seconds, path),
+        daemon=True
+    ).start()
+    return True
+
+
+def install_signal_handlers() -> None:
+    """SIGUSR1 starts the sampling profiler, SIGUSR2 toggles stage timers."""
+    if not hasattr(signal, 'SIGUSR1'):
+        logger.warning('Profiling signals are not supported on this platform.')
+        return
+    signal.signal(signal.SIGUSR1, lambda signum, frame: start_sampling())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: toggle_timers())
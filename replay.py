@@ -0,0 +1,336 @@
+import argparse
+import codecs
+import collections
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import statistics
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+import requests
+
+from clock import SimulatedClock
+from outbox import Outbox
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant
+
+logger = logging.getLogger(__name__)
+
+
+def _open(path: str, mode: str):
+    """Open a traffic file, gzip-compressed when it ends with .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def tenant_key(headers: Optional[dict]) -> Optional[str]:
+    """Short hash of the token of a request, names the tenant in the file."""
+    authorization = (headers or {}).get('Authorization')
+    if not authorization:
+        return None
+    token = authorization.split()[-1]
+    return hashlib.blake2b(token.encode(), digest_size=6).hexdigest()
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """Read the recorded exchanges one by one."""
+    with _open(path, 'r') as traffic_file:
+        for line in traffic_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RecordedResponse:
+    """Response passed to the bot while its body is being recorded.
+
+    A streamed body is written as body records chunk by chunk, so the
+    recorder never holds it whole.
+    """
+
+    def __init__(self, recorder, request_id: int, response) -> None:
+        self.recorder = recorder
+        self.request_id = request_id
+        self.response = response
+        self.status_code = response.status_code
+        self.reason = getattr(response, 'reason', '')
+        self.recorded = False
+
+    def _write_body(self, text: str) -> None:
+        self.recorder.write({
+            'kind': 'body', 'request': self.request_id, 'text': text
+        })
+
+    @property
+    def text(self) -> str:
+        text = self.response.text
+        if not self.recorded:
+            self.recorded = True
+            self._write_body(text)
+        return text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size: int = 1):
+        self.recorded = True
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in self.response.iter_content(chunk_size):
+            text = decoder.decode(chunk)
+            if text:
+                self._write_body(text)
+            yield chunk
+        text = decoder.decode(b'', final=True)
+        if text:
+            self._write_body(text)
+
+    def close(self) -> None:
+        self.response.close()
+
+
+class Recorder:
+    """Captures API responses and Telegram sends of the running bot.
+
+    Only a hash of the token, the request parameters, the response status
+    and body and the text of sent messages are written, tokens and chat
+    ids never reach the file. The poll workers share the file, every
+    record is written whole under a lock.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.started = None
+        self.file = None
+        self.bot = None
+        self.original_get = None
+        self.original_send = None
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+
+    def write(self, record: dict) -> None:
+        """Append a record with its offset from the start of recording."""
+        record['t'] = round(time.monotonic() - self.started, 3)
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def get(self, *args, **kwargs):
+        """requests.get replacement recording the exchange."""
+        record = {
+            'kind': 'api',
+            'request': next(self.request_ids),
+            'tenant': tenant_key(kwargs.get('headers')),
+            'params': kwargs.get('params'),
+        }
+        try:
+            response = self.original_get(*args, **kwargs)
+        except Exception as error:
+            record['error'] = str(error)
+            self.write(record)
+            raise
+        record['status'] = response.status_code
+        self.write(record)
+        return RecordedResponse(self, record['request'], response)
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        """bot.send_message replacement recording the sent text."""
+        result = self.original_send(chat_id, text, **kwargs)
+        self.write({'kind': 'send', 'text': text})
+        return result
+
+    def install(self, bot) -> None:
+        """Start recording the traffic of the given bot."""
+        self.started = time.monotonic()
+        self.file = _open(self.path, 'a')
+        self.bot = bot
+        self.original_get = requests.get
+        self.original_send = bot.send_message
+        requests.get = self.get
+        bot.send_message = self.send_message
+        logger.info(f'Recording traffic to {self.path}')
+
+    def uninstall(self) -> None:
+        """Stop recording and restore the original functions."""
+        requests.get = self.original_get
+        self.bot.send_message = self.original_send
+        self.file.close()
+
+
+class ReplayResponse:
+    """Recorded API response served back to get_api_answer."""
+
+    def __init__(self, record: dict) -> None:
+        self.status_code = record['status']
+        self.reason = ''
+        self.text = record['body']
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size: int = 1):
+        content = self.text.encode()
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayBot:
+    """Telegram bot stand-in collecting the messages sent during replay."""
+
+    def __init__(self) -> None:
+        self.sent = []
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        self.sent.append(text)
+
+
+class Replayer:
+    """Feeds recorded traffic back through the poll loop.
+
+    Each tenant gets the responses recorded for it, in order. A replayed
+    tenant is recognised by the recorded key used as its token or, for
+    recordings without tenants, takes the responses of the only one.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.records = list(read_records(path))
+        bodies = collections.defaultdict(list)
+        for record in self.records:
+            if record['kind'] == 'body':
+                bodies[record['request']].append(record['text'])
+        self.polls = [
+            record for record in self.records if record['kind'] == 'api'
+        ]
+        for record in self.polls:
+            if 'body' not in record and 'status' in record:
+                record['body'] = ''.join(bodies[record.get('request')])
+        self.tenants = list(dict.fromkeys(
+            record.get('tenant') for record in self.polls
+        ))
+        self.queues = {}
+        self.served = 0
+        self.lock = threading.Lock()
+
+    def rewind(self) -> None:
+        """Start serving the recorded responses from the beginning."""
+        self.queues = {tenant: collections.deque() for tenant in self.tenants}
+        for record in self.polls:
+            self.queues[record.get('tenant')].append(record)
+        self.served = 0
+
+    def get(self, *args, **kwargs):
+        """requests.get replacement serving the tenant's next response."""
+        authorization = (kwargs.get('headers') or {}).get('Authorization')
+        token = authorization.split()[-1] if authorization else None
+        with self.lock:
+            queue = self.queues.get(token)
+            if queue is None:
+                queue = self.queues.get(tenant_key(kwargs.get('headers')))
+            if queue is None and len(self.queues) == 1:
+                [queue] = self.queues.values()
+            if not queue:
+                raise requests.ConnectionError('No recorded response left')
+            record = queue.popleft()
+            self.served += 1
+        if 'error' in record:
+            raise requests.ConnectionError(record['error'])
+        return ReplayResponse(record)
+
+    def run(self, poll: Callable, *args, speed: Optional[float] = None) -> dict:
+        """Replay every recorded poll and report CPU time and latency.
+
+        poll(bot, *args) is called until every recorded API response is
+        served or a call serves none. With speed None the calls follow
+        each other without pauses, otherwise the recorded pauses between
+        the first responses they serve are divided by speed. Messages of
+        different tenants may be sent in another order than recorded.
+        """
+        bot = ReplayBot()
+        latencies = []
+        original_get = requests.get
+        requests.get = self.get
+        self.rewind()
+        cpu_started = time.process_time()
+        try:
+            previous = None
+            while any(self.queues.values()):
+                following = min(
+                    queue[0]['t'] for queue in self.queues.values() if queue
+                )
+                if speed and previous is not None:
+                    time.sleep(max(0.0, following - previous) / speed)
+                previous = following
+                served = self.served
+                started = time.perf_counter()
+                poll(bot, *args)
+                latencies.append(time.perf_counter() - started)
+                if self.served == served:
+                    logger.warning('Replay stopped, no tenant was polled')
+                    break
+        finally:
+            requests.get = original_get
+        cpu_seconds = time.process_time() - cpu_started
+        expected = [
+            record['text'] for record in self.records
+            if record['kind'] == 'send'
+        ]
+        if len(self.tenants) > 1:
+            matches = collections.Counter(bot.sent) == collections.Counter(
+                expected
+            )
+        else:
+            matches = bot.sent == expected
+        return {
+            'polls': self.served,
+            'cpu_seconds': round(cpu_seconds, 6),
+            'latency_p50_ms': round(
+                statistics.median(latencies) * 1000, 3
+            ) if latencies else 0,
+            'latency_max_ms': round(max(latencies, default=0) * 1000, 3),
+            'sent': len(bot.sent),
+            'matches_recording': matches,
+        }
+
+
+if __name__ == '__main__':
+    import homework
+
+    parser = argparse.ArgumentParser(
+        description='Replay recorded traffic through the poll loop.'
+    )
+    parser.add_argument('path', help='Recorded traffic file.')
+    parser.add_argument(
+        '--speed', type=float, default=None,
+        help='Time acceleration factor, as fast as possible when omitted.'
+    )
+    args = parser.parse_args()
+    replayer = Replayer(args.path)
+    states = TenantStateTable()
+    outbox = Outbox(':memory:')
+    clock = SimulatedClock()
+    scheduler = PollScheduler(clock, interval=0)
+    tenants = {}
+    for key in replayer.tenants:
+        tenant_id = key or 'replay'
+        first_poll = next(
+            record for record in replayer.polls
+            if record.get('tenant') == key
+        )
+        tenants[tenant_id] = Tenant(tenant_id, tenant_id, tenant_id)
+        states.add(
+            tenant_id, (first_poll.get('params') or {}).get('from_date', 0)
+        )
+        scheduler.add(tenant_id)
+    report = replayer.run(
+        homework.poll_round, tenants, states, outbox, scheduler, clock,
+        speed=args.speed
+    )
+    print(json.dumps(report))
@@ -0,0 +1,164 @@
+import collections
+import heapq
+import math
+from typing import Optional
+
+import metrics
+
+LANE_WEIGHTS = {
+    'reviewing': 8,
+    'active': 4,
+    'idle': 2,
+    'quarantined': 1,
+}
+DEFAULT_LANE = 'idle'
+LAG_BUCKETS = (1, 5, 15, 60, 300, 600, 1800, 3600)
+
+
+class PollScheduler:
+    """Tenants waiting for their next poll, served by priority lanes.
+
+    A heap orders the tenants by the time of their next poll. Tenants that
+    are due move to the queue of their lane, and the lanes share the polls
+    by weighted fair queueing: each poll costs a lane 1 / weight, the lane
+    that spent least goes first. Every lane with waiting tenants gets at
+    least its weight share of the polls and serves them in the order they
+    became due, so under overload low lanes slow down but never starve.
+
+    Polls keep a fixed rate: the next poll is one interval after the
+    previous due time, but never in the past, so a late round does not
+    turn into a burst of catch-up polls.
+    """
+
+    def __init__(self, clock, interval: float) -> None:
+        self.clock = clock
+        self.interval = interval
+        self.heap = []
+        self.due_times = {}
+        self.sequence = 0
+        self.lanes = {lane: collections.deque() for lane in LANE_WEIGHTS}
+        self.ready = {}
+        self.lane_of = {}
+        self.spent = dict.fromkeys(LANE_WEIGHTS, 0.0)
+        self.lag = metrics.histogram(
+            'poll_scheduling_lag_seconds',
+            'Time from the due time of a poll to its start, by lane.',
+            LAG_BUCKETS, ('lane',)
+        )
+
+    def __len__(self) -> int:
+        return len(self.due_times) + len(self.ready)
+
+    def __contains__(self, tenant_id: str) -> bool:
+        return tenant_id in self.due_times or tenant_id in self.ready
+
+    def schedule(self, tenant_id: str, due: float) -> None:
+        """Set the time of the next poll of the tenant."""
+        self.due_times[tenant_id] = due
+        self.sequence += 1
+        heapq.heappush(self.heap, (due, self.sequence, tenant_id))
+
+    def add(self, tenant_id: str, delay: float = 0,
+            lane: str = DEFAULT_LANE) -> None:
+        """Start polling the tenant after the delay."""
+        self.lane_of[tenant_id] = lane
+        self.schedule(tenant_id, self.clock.time() + delay)
+
+    def remove(self, tenant_id: str) -> None:
+        """Stop polling the tenant, its queued entries are skipped later."""
+        self.due_times.pop(tenant_id, None)
+        self.ready.pop(tenant_id, None)
+        self.lane_of.pop(tenant_id, None)
+
+    def set_lane(self, tenant_id: str, lane: str) -> None:
+        """Move the tenant to another lane from its next poll."""
+        if tenant_id in self.lane_of:
+            self.lane_of[tenant_id] = lane
+
+    def _discard_stale(self) -> None:
+        while self.heap:
+            due, _, tenant_id = self.heap[0]
+            if self.due_times.get(tenant_id) == due:
+                return
+            heapq.heappop(self.heap)
+
+    def _release_due(self, now: float) -> None:
+        """Move the tenants due by now from the heap to their lanes."""
+        heap = self.heap
+        due_times = self.due_times
+        while heap and heap[0][0] <= now:
+            due, _, tenant_id = heapq.heappop(heap)
+            if due_times.get(tenant_id) != due:
+                continue
+            del due_times[tenant_id]
+            lane = self.lane_of[tenant_id]
+            queue = self.lanes[lane]
+            if not queue:
+                busy = [
+                    self.spent[other] for other in LANE_WEIGHTS
+                    if self.lanes[other]
+                ]
+                if busy:
+                    self.spent[lane] = max(self.spent[lane], min(busy))
+            queue.append((tenant_id, due))
+            self.ready[tenant_id] = due
+
+    def _head(self, lane: str) -> Optional[tuple]:
+        """Oldest live entry of the lane queue."""
+        queue = self.lanes[lane]
+        while queue:
+            tenant_id, due = queue[0]
+            if self.ready.get(tenant_id) == due:
+                return queue[0]
+            queue.popleft()
+        return None
+
+    def _next_lane(self) -> Optional[str]:
+        """Lane with waiting tenants that spent least."""
+        chosen = None
+        least = math.inf
+        spent = self.spent
+        for lane, queue in self.lanes.items():
+            if queue and spent[lane] < least and self._head(lane):
+                chosen = lane
+                least = spent[lane]
+        return chosen
+
+    def pop_due(self, limit: Optional[int] = None) -> list:
+        """Take up to limit due tenants as (tenant_id, due) pairs."""
+        now = self.clock.time()
+        self._release_due(now)
+        ready = self.ready
+        if not ready:
+            return []
+        due_tenants = []
+        while limit is None or len(due_tenants) < limit:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            tenant_id, due = self.lanes[lane].popleft()
+            del ready[tenant_id]
+            self.spent[lane] += 1 / LANE_WEIGHTS[lane]
+            self.lag.observe(now - due, lane)
+            due_tenants.append((tenant_id, due))
+        return due_tenants
+
+    def reschedule(self, tenant_id: str, due: float) -> None:
+        """Schedule the next poll of a tenant polled for the given due time."""
+        self.schedule(
+            tenant_id, max(due + self.interval, self.clock.time())
+        )
+
+    def next_due(self) -> Optional[float]:
+        """Due time of the nearest poll, None without tenants."""
+        if self.ready:
+            return min(self.ready.values())
+        self._discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def time_to_next(self) -> float:
+        """Seconds to sleep until the nearest poll."""
+        next_due = self.next_due()
+        if next_due is None:
+            return self.interval
+        return max(0.0, next_due - self.clock.time())
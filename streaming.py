@@ -0,0 +1,132 @@
+import codecs
+import json
+from typing import Iterable, Iterator
+
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'br, gzip, deflate'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class HomeworkStream:
+    """Incremental parser of the homework statuses response.
+
+    Takes the body as an iterable of byte chunks, already decompressed,
+    and yields the records of the homeworks list one at a time, so only
+    the current record is held in memory. The other keys of the response
+    are collected in extra. Malformed responses raise the same errors as
+    check_response.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.extra = {}
+
+    def _read(self) -> bool:
+        """Append the next chunk to the buffer, False at the end of body."""
+        if self.eof:
+            return False
+        if self.position:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        self.buffer += self.decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def _peek(self) -> str:
+        """Next significant character, empty at the end of body."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return ''
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if not character or character not in characters:
+            raise ValueError(
+                f'Malformed response from the server, expected '
+                f'{" or ".join(characters)} at {character!r}'
+            )
+        self.position += 1
+        return character
+
+    def _value(self):
+        """Decode the next JSON value, reading more of the body if needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            if end == len(self.buffer) and self._read():
+                continue
+            self.position = end
+            return value
+
+    def _homeworks(self) -> Iterator[dict]:
+        if self._peek() != '[':
+            homeworks = self._value()
+            raise TypeError(
+                f'Wrong data type received - '
+                f'{type(homeworks)}, expected list'
+            )
+        self.position += 1
+        if self._peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def __iter__(self) -> Iterator[dict]:
+        if self._peek() != '{':
+            response = self._value()
+            raise TypeError(
+                f'Wrong data type received - '
+                f'{type(response)}, dictionary expected'
+            )
+        self.position += 1
+        if self._peek() == '}':
+            raise ValueError(
+                'Received an empty dictionary in response from the server.'
+            )
+        found = False
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'homeworks':
+                found = True
+                yield from self._homeworks()
+            else:
+                self.extra[key] = self._value()
+            if self._expect(',}') == '}':
+                break
+        if not found:
+            raise KeyError(
+                'The resulting dictionary does not contain the homeworks key.'
+            )
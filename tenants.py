@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import signal
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant(NamedTuple):
+    """Student whose homework is polled and the chat to notify."""
+
+    id: str
+    practicum_token: str
+    chat_id: str
+    group: str = 'default'
+
+
+def load_tenants(path: str) -> dict:
+    """Read the registry file: a JSON list of tenants.
+
+    Each tenant has practicum_token and chat_id, the id defaults to the
+    chat id and the group used in latency reports to default.
+    """
+    with open(path, encoding='utf-8') as registry_file:
+        records = json.load(registry_file)
+    if not isinstance(records, list):
+        raise TypeError(
+            f'Wrong data type received - {type(records)}, expected list'
+        )
+    tenants = {}
+    for record in records:
+        chat_id = str(record['chat_id'])
+        tenant = Tenant(
+            str(record.get('id', chat_id)), record['practicum_token'],
+            chat_id, str(record.get('group', 'default'))
+        )
+        tenants[tenant.id] = tenant
+    return tenants
+
+
+def diff_tenants(old: dict, new: dict) -> tuple:
+    """Added, removed and updated tenants between two registries."""
+    added = [tenant for tenant_id, tenant in new.items() if tenant_id not in old]
+    removed = [tenant_id for tenant_id in old if tenant_id not in new]
+    updated = [
+        tenant for tenant_id, tenant in new.items()
+        if tenant_id in old and old[tenant_id] != tenant
+    ]
+    return added, removed, updated
+
+
+class TenantRegistry:
+    """Registry file reloaded when it changes or on SIGHUP."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.mtime = None
+        self.reload_requested = True
+
+    def request_reload(self, *args) -> None:
+        """Reload on the next check, usable as a signal handler."""
+        self.reload_requested = True
+
+    def install_signal_handler(self) -> None:
+        """Reload the registry on SIGHUP."""
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+    def check(self) -> Optional[dict]:
+        """New tenants when the file changed, None otherwise.
+
+        A broken file is logged and the current tenants are kept.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as error:
+            logger.error(f'Tenant registry is not available: {error}')
+            return None
+        if mtime == self.mtime and not self.reload_requested:
+            return None
+        self.mtime = mtime
+        self.reload_requested = False
+        try:
+            tenants = load_tenants(self.path)
+        except Exception as error:
+            logger.error(f'Error reading the tenant registry: {error}')
+            return None
+        logger.info(f'Tenant registry loaded, {len(tenants)} tenants')
+        return tenants
@@ -0,0 +1,82 @@
+import requests
+
+import latency
+from clock import SimulatedClock
+from outbox import Outbox
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant
+from utils import MockBot, MockResponse
+
+UPDATED = '2022-04-15T06:12:40Z'
+UPDATED_AT = 1650003160.0
+
+
+CHANGED = {'homeworks': [{
+    'id': 1,
+    'homework_name': 'hw123',
+    'status': 'approved',
+    'date_updated': UPDATED,
+}]}
+
+
+def row(tenant_id, detect, group='default'):
+    return (tenant_id, group, 1000.0, 1000.0 + detect,
+            1001.0 + detect, 1003.0 + detect)
+
+
+class TestLatency:
+
+    def test_parse_date_updated(self):
+        assert latency.parse_date_updated(UPDATED) == UPDATED_AT
+        assert latency.parse_date_updated(None) is None
+        assert latency.parse_date_updated('yesterday') is None
+
+    def test_stage_latencies(self):
+        assert latency.stage_latencies(row('1', 300)) == {
+            'detect': 300, 'enqueue': 1, 'deliver': 2, 'total': 303,
+        }
+        assert latency.stage_latencies(
+            ('1', 'default', None, None, 10.0, 15.0)
+        ) == {'deliver': 5}
+
+    def test_report_flags_tenants_missing_slo(self):
+        rows = [row('fast', 60) for _ in range(20)]
+        rows += [row('slow', 600, 'evening') for _ in range(19)]
+        rows += [row('slow', 2000, 'evening')]
+        result = latency.report(rows, slo=900, share=0.95)
+        assert result['groups']['default']['detect']['p95'] == 60
+        assert [tenant['tenant_id'] for tenant in result['missing_slo']] == []
+        result = latency.report(rows, slo=900, share=0.99)
+        assert result['missing_slo'] == [{
+            'tenant_id': 'slow',
+            'group': 'evening',
+            'notifications': 20,
+            'detect': 2000,
+            'total': 2003,
+        }]
+
+    def test_delivered_notification_timings(self, monkeypatch):
+        import homework
+
+        clock = SimulatedClock(start=UPDATED_AT + 120)
+        monkeypatch.setattr(
+            requests, 'get', lambda *a, **kw: MockResponse(CHANGED)
+        )
+        tenants = {'1': Tenant('1', 'token', '1', 'evening')}
+        states = TenantStateTable()
+        states.add('1', 0)
+        scheduler = PollScheduler(clock, homework.RETRY_TIME)
+        scheduler.add('1')
+        outbox = Outbox(':memory:', clock)
+        before = latency.notification_latency.count('evening', 'total')
+        homework.poll_round(
+            MockBot(), tenants, states, outbox, scheduler, clock
+        )
+        [delivered] = outbox.delivered(since=0)
+        assert delivered == (
+            '1', 'evening', UPDATED_AT, UPDATED_AT + 120,
+            UPDATED_AT + 120, UPDATED_AT + 120
+        )
+        total = latency.notification_latency.count('evening', 'total')
+        assert total == before + 1
@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+import time
+from http import HTTPStatus
+
+import pytest
+import requests
+
+import metrics
+from clock import SimulatedClock
+from limiter import AdaptiveLimiter, is_overload
+from my_exception import EndpointError, RequestError
+from tenant_state import TenantStateTable
+from tenants import Tenant
+from utils import MockBot, MockResponse
+
+
+def wrapped(error):
+    try:
+        try:
+            raise error
+        except Exception as cause:
+            raise RequestError(f'{cause}') from cause
+    except RequestError as request_error:
+        return request_error
+
+
+class TestLimiter:
+
+    def test_is_overload(self):
+        assert is_overload(wrapped(requests.Timeout('timed out')))
+        assert is_overload(wrapped(
+            EndpointError('busy', HTTPStatus.TOO_MANY_REQUESTS)
+        ))
+        assert is_overload(wrapped(
+            EndpointError('down', HTTPStatus.BAD_GATEWAY)
+        ))
+        assert not is_overload(wrapped(
+            EndpointError('denied', HTTPStatus.UNAUTHORIZED)
+        ))
+        assert not is_overload(wrapped(ValueError('bad json')))
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=4)
+        for _ in range(2):
+            with limiter.slot():
+                pass
+        assert int(limiter.limit) == 3
+        for _ in range(20):
+            with limiter.slot():
+                pass
+        assert limiter.limit == 4
+        assert metrics.gauge('upstream_concurrency_limit', '').value == 4
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial_limit=8, max_limit=8)
+        with pytest.raises(RequestError):
+            with limiter.slot():
+                raise wrapped(
+                    EndpointError('busy', HTTPStatus.SERVICE_UNAVAILABLE)
+                )
+        assert limiter.limit == 4
+        started = limiter.last_cut - 1
+        limiter.in_flight += 1
+        limiter.release(started, wrapped(requests.Timeout('timed out')))
+        assert limiter.limit == 4
+
+    def test_slow_upstream_holds_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=2, latency_target=0.0)
+        limiter.in_flight += 1
+        limiter.release(time.monotonic() - 1)
+        assert limiter.limit == 2
+
+    def test_acquire_waits_for_slot(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+        started = limiter.acquire()
+        acquired = threading.Event()
+
+        def worker():
+            limiter.release(limiter.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not acquired.wait(0.05)
+        limiter.release(started)
+        assert acquired.wait(1)
+        thread.join()
+
+    def test_timed_out_request_cuts_limit(self, monkeypatch):
+        import homework
+
+        calls = []
+
+        def hung_get(*args, **kwargs):
+            calls.append(kwargs)
+            raise requests.ReadTimeout('read timed out')
+
+        limiter = AdaptiveLimiter(initial_limit=8, max_limit=8)
+        monkeypatch.setattr(homework, 'upstream_limiter', limiter)
+        monkeypatch.setattr(requests, 'get', hung_get)
+        states = TenantStateTable()
+        states.add('1', 0)
+        homework.check_updates(
+            MockBot(), states, None, Tenant('1', 'token', '1'),
+            SimulatedClock()
+        )
+        assert calls[0]['timeout'] == homework.REQUEST_TIMEOUT
+        assert limiter.limit == 4
+        assert limiter.in_flight == 0
+        assert states.failures[0] == 1
+
+    @pytest.mark.parametrize('status, body', [
+        (HTTPStatus.SERVICE_UNAVAILABLE, ''),
+        (HTTPStatus.SERVICE_UNAVAILABLE, 'Service Unavailable'),
+        (HTTPStatus.TOO_MANY_REQUESTS, 'Too Many Requests'),
+    ])
+    def test_error_response_without_message_cuts_limit(
+        self, monkeypatch, status, body
+    ):
+        import homework
+
+        limiter = AdaptiveLimiter(initial_limit=8, max_limit=8)
+        monkeypatch.setattr(
+            requests, 'get', lambda *a, **kw: MockResponse(body, status)
+        )
+        with pytest.raises(RequestError) as error:
+            with limiter.slot():
+                homework.open_homeworks('token', 0, stream=True)
+        assert isinstance(error.value.__cause__, EndpointError)
+        assert error.value.__cause__.status_code == status
+        assert status.phrase in str(error.value) or body in str(error.value)
+        assert is_overload(error.value)
+        assert limiter.limit == 4
+
+    @pytest.mark.parametrize('collect_error, upstream_error', [
+        (sqlite3.OperationalError('database is locked'), None),
+        (None, requests.exceptions.ChunkedEncodingError('broken')),
+    ])
+    def test_limiter_gets_only_the_upstream_part_of_a_poll(
+        self, monkeypatch, collect_error, upstream_error
+    ):
+        import homework
+
+        class BrokenResponse(MockResponse):
+            def iter_content(self, chunk_size=1):
+                first, *rest = self.chunks()
+                yield first
+                if upstream_error is not None:
+                    raise upstream_error
+                yield from rest
+
+        def slow_collect(states, row, tenant, homeworks, outbox):
+            for _ in homeworks:
+                pass
+            time.sleep(0.2)
+            raise collect_error
+
+        limiter = AdaptiveLimiter(initial_limit=8, max_limit=8)
+        monkeypatch.setattr(homework, 'upstream_limiter', limiter)
+        monkeypatch.setattr(
+            requests, 'get',
+            lambda *a, **kw: BrokenResponse(
+                '{"homeworks": [], "current_date": 1}', chunk_size=18
+            )
+        )
+        monkeypatch.setattr(homework, 'collect_messages', slow_collect)
+        states = TenantStateTable()
+        states.add('1', 0)
+        homework.check_updates(
+            MockBot(), states, None, Tenant('1', 'token', '1'),
+            SimulatedClock()
+        )
+        assert states.failures[0] == 1
+        assert limiter.in_flight == 0
+        assert list(limiter.errors) == [upstream_error is not None]
+        assert limiter.latencies[0] < 0.2
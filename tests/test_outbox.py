@@ -0,0 +1,225 @@
+import sqlite3
+
+import pytest
+import requests
+
+import outbox as outbox_module
+from clock import SimulatedClock
+from outbox import Outbox, message_key
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant
+from utils import MockBot, MockResponse
+
+
+class FlakySender:
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.sent = []
+
+    def __call__(self, chat_id, text):
+        if text == self.fail_on:
+            raise ConnectionError('Telegram is unavailable')
+        self.sent.append((chat_id, text))
+
+
+class TestOutbox:
+
+    def test_message_key(self):
+        homework = {'id': 1, 'status': 'approved', 'date_updated': 'x'}
+        assert message_key('1', homework) == message_key('1', dict(homework))
+        assert message_key('1', homework) != message_key('2', homework)
+        rejected = dict(homework, status='rejected')
+        assert message_key('1', homework) != message_key('1', rejected)
+
+    def test_enqueue_is_idempotent(self, tmp_path):
+        outbox = Outbox(str(tmp_path / 'outbox.sqlite3'))
+        assert outbox.cursor('1') is None
+        messages = [('a', 'A', None), ('b', 'B', None)]
+        assert outbox.enqueue('1', '1', messages, 100) == 2
+        assert outbox.enqueue('1', '1', [('b', 'B', None)], 200) == 0
+        assert outbox.cursor('1') == 200
+        assert [row[0] for row in outbox.pending()] == ['a', 'b']
+
+    def test_state_survives_restart(self, tmp_path):
+        path = str(tmp_path / 'outbox.sqlite3')
+        outbox = Outbox(path)
+        outbox.enqueue('1', '1', [('a', 'A', None)], 100)
+        outbox.close()
+        outbox = Outbox(path)
+        assert outbox.cursor('1') == 100
+        assert outbox.pending() == [('a', '1', 'A')]
+
+    def test_drain_keeps_failed_messages(self):
+        clock = SimulatedClock()
+        outbox = Outbox(':memory:', clock)
+        messages = [('a', 'A', None), ('b', 'B', None), ('c', 'C', None)]
+        outbox.enqueue('1', '1', messages, 1)
+        sender = FlakySender(fail_on='B')
+        assert outbox.drain(sender, batch_size=2) == 2
+        assert sender.sent == [('1', 'A'), ('1', 'C')]
+        assert outbox.pending() == []
+        sender.fail_on = None
+        clock.sleep(outbox_module.RETRY_DELAY)
+        assert outbox.drain(sender, batch_size=2) == 1
+        assert outbox.pending() == []
+        assert outbox.enqueue('1', '1', [('a', 'A', None)], 2) == 0
+
+    def test_failing_chat_does_not_block_others(self):
+        clock = SimulatedClock()
+        outbox = Outbox(':memory:', clock)
+        outbox.enqueue('blocked', 'blocked', [('a', 'A', None)], 1)
+        outbox.enqueue('healthy', 'healthy', [('b', 'B', None)], 1)
+        sender = FlakySender(fail_on='A')
+        assert outbox.drain(sender) == 1
+        assert sender.sent == [('healthy', 'B')]
+        delays = []
+        for _ in range(outbox_module.MAX_ATTEMPTS - 1):
+            assert outbox.drain(sender) == 0
+            delays.append(outbox.connection.execute(
+                "SELECT next_attempt_at FROM messages WHERE key = 'a'"
+            ).fetchone()[0] - clock.time())
+            clock.sleep(delays[-1])
+            assert outbox.drain(sender) == 0
+        assert delays[:2] == [60, 120]
+        assert max(delays) == outbox_module.MAX_RETRY_DELAY
+        assert outbox.pending() == []
+        assert outbox.parked() == [('a', 'blocked', 'A')]
+
+    def test_staged_messages_wait_for_commit(self):
+        outbox = Outbox(':memory:')
+        assert outbox.stage('1', '1', [('c', 'C', 3.0), ('b', 'B', 2.0)]) == 2
+        assert outbox.stage('1', '1', [('a', 'A', 1.0)]) == 1
+        assert outbox.pending() == []
+        assert outbox.cursor('1') is None
+        assert outbox.commit_staged('1', 100, detected_at=5.0) == 3
+        assert outbox.cursor('1') == 100
+        assert [row[0] for row in outbox.pending()] == ['a', 'b', 'c']
+        assert outbox.stage('1', '1', [('a', 'A', 1.0)]) == 0
+
+    def test_history_is_staged_in_chunks(self, monkeypatch):
+        import homework
+
+        response = MockResponse({'homeworks': [
+            {
+                'id': number,
+                'homework_name': f'hw{number}',
+                'status': 'approved',
+                'date_updated': f'2022-04-1{number}T06:12:40Z',
+            }
+            for number in range(5, 0, -1)
+        ]})
+        outbox = Outbox(':memory:')
+        chunks = []
+        stage = outbox.stage
+
+        def recording_stage(tenant_id, chat_id, messages, group):
+            chunks.append(len(messages))
+            assert outbox.pending() == []
+            return stage(tenant_id, chat_id, messages, group)
+
+        monkeypatch.setattr(outbox, 'stage', recording_stage)
+        monkeypatch.setattr(homework, 'STAGE_SIZE', 2)
+        monkeypatch.setattr(requests, 'get', lambda *a, **kw: response)
+        states = TenantStateTable()
+        states.add('1', 0)
+        homework.check_updates(
+            None, states, outbox, Tenant('1', 'token', '1'), SimulatedClock()
+        )
+        assert chunks == [2, 2, 1]
+        assert [row[2].split('"')[1] for row in outbox.pending()] == [
+            'hw1', 'hw2', 'hw3', 'hw4', 'hw5'
+        ]
+        assert not states.is_new_message(0, outbox.pending()[-1][2])
+
+    @pytest.mark.parametrize('current_date, cursor', [
+        (1650000100, 1650000100),
+        (None, 1650000000),
+    ])
+    def test_cursor_is_taken_before_reading(self, monkeypatch, current_date,
+                                            cursor):
+        import homework
+
+        clock = SimulatedClock(start=1650000000)
+
+        class SlowResponse(MockResponse):
+            def iter_content(self, chunk_size=1):
+                clock.sleep(300)
+                yield from super().iter_content(chunk_size)
+
+        body = {'homeworks': []}
+        if current_date:
+            body['current_date'] = current_date
+        monkeypatch.setattr(
+            requests, 'get', lambda *a, **kw: SlowResponse(body)
+        )
+        outbox = Outbox(':memory:', clock)
+        states = TenantStateTable()
+        states.add('1', 0)
+        homework.check_updates(
+            None, states, outbox, Tenant('1', 'token', '1'), clock
+        )
+        assert states.cursors[0] == cursor
+        assert outbox.cursor('1') == cursor
+
+    def test_migrates_old_schema(self, tmp_path):
+        path = str(tmp_path / 'outbox.sqlite3')
+        connection = sqlite3.connect(path)
+        connection.execute(
+            'CREATE TABLE messages (key TEXT PRIMARY KEY, tenant_id TEXT, '
+            'chat_id TEXT, text TEXT, created_at REAL, delivered_at REAL, '
+            'attempts INTEGER NOT NULL DEFAULT 0)'
+        )
+        connection.execute(
+            "INSERT INTO messages VALUES ('a', '1', '1', 'A', 1, NULL, 0)"
+        )
+        connection.commit()
+        connection.close()
+        outbox = Outbox(path)
+        outbox.ack(['a'])
+        [row] = outbox.delivered(['a'])
+        assert row[:4] == ('1', 'default', None, None)
+
+    def test_prune_delivered(self):
+        outbox = Outbox(':memory:')
+        outbox.enqueue('1', '1', [('a', 'A', None), ('b', 'B', None)], 1)
+        outbox.ack(['a'])
+        outbox.prune(retention=-1)
+        assert outbox.enqueue('1', '1', [('a', 'A', None)], 2) == 1
+        assert len(outbox.pending()) == 2
+
+    def test_failed_delivery_is_retried(self, monkeypatch):
+        import homework
+
+        class UnavailableBot(MockBot):
+            available = False
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                if not self.available:
+                    raise ConnectionError('Telegram is unavailable')
+                return super().send_message(chat_id, text)
+
+        response = MockResponse({'homeworks': [{
+            'id': 1,
+            'homework_name': 'hw123',
+            'status': 'approved',
+            'date_updated': '2022-04-15T06:12:40Z',
+        }]})
+
+        states = TenantStateTable()
+        states.add('1', 0)
+        clock = SimulatedClock(start=1650000000)
+        outbox = Outbox(':memory:', clock)
+        bot = UnavailableBot()
+        scheduler = PollScheduler(clock, interval=0)
+        scheduler.add('1')
+        tenants = {'1': Tenant('1', 'token', '1')}
+        monkeypatch.setattr(requests, 'get', lambda *a, **kw: response)
+        homework.poll_round(bot, tenants, states, outbox, scheduler, clock)
+        assert bot.sent == []
+        assert states.cursors[0] > 0
+        bot.available = True
+        clock.sleep(outbox_module.RETRY_DELAY)
+        homework.poll_round(bot, tenants, states, outbox, scheduler, clock)
+        assert len(bot.sent) == 1
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import profiling
+
+
+class TestProfiling:
+
+    def test_stage_timer_disabled(self, monkeypatch):
+        monkeypatch.setattr(profiling, 'timers_enabled', False)
+        profiling.stage_stats.clear()
+
+        @profiling.stage_timer('stage')
+        def stage(value):
+            return value
+
+        assert stage(1) == 1
+        assert 'stage' not in profiling.stage_stats
+
+    def test_stage_timer_enabled(self, monkeypatch):
+        monkeypatch.setattr(profiling, 'timers_enabled', False)
+        profiling.toggle_timers()
+
+        @profiling.stage_timer('stage')
+        def stage(value):
+            return value
+
+        stage(1)
+        stage(2)
+        profiling.toggle_timers()
+        assert profiling.stage_stats['stage'][0] == 2
+        assert not profiling.timers_enabled
+
+    def test_stage_timer_from_threads(self, monkeypatch):
+        monkeypatch.setattr(profiling, 'timers_enabled', False)
+        profiling.toggle_timers()
+
+        @profiling.stage_timer('stage')
+        def stage():
+            pass
+
+        def worker():
+            for _ in range(1000):
+                stage()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        profiling.toggle_timers()
+        assert profiling.stage_stats['stage'][0] == 8000
+
+    def test_handlers_interrupting_lock_holder(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(profiling, 'timers_enabled', False)
+        monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+        def interrupted_stage():
+            with profiling._stats_lock:
+                profiling.toggle_timers()
+                profiling.toggle_timers()
+            with profiling._sampler_lock:
+                profiling.start_sampling(seconds=0.05)
+
+        thread = threading.Thread(target=interrupted_stage, daemon=True)
+        thread.start()
+        thread.join(2)
+        assert not thread.is_alive()
+        deadline = time.monotonic() + 5
+        while profiling._sampler_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_sampling_dumps_files(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+        stop = threading.Event()
+
+        def polling_worker():
+            while not stop.is_set():
+                time.sleep(0.001)
+
+        worker = threading.Thread(target=polling_worker, name='poll-worker')
+        worker.start()
+        try:
+            assert profiling.start_sampling(seconds=0.05)
+            assert not profiling.start_sampling(seconds=0.05)
+            deadline = time.monotonic() + 5
+            while profiling._sampler_running and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            worker.join()
+        names = sorted(path.suffix for path in tmp_path.iterdir())
+        assert names == ['.memory', '.stacks']
+        [stacks] = tmp_path.glob('*.stacks')
+        assert 'poll-worker;' in stacks.read_text()
+        assert 'polling_worker (test_profiling.py' in stacks.read_text()
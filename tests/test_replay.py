@@ -0,0 +1,126 @@
+import json
+import os
+
+import requests
+
+import replay
+from clock import SimulatedClock
+from outbox import Outbox
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant
+from utils import MockBot, MockResponse
+
+TRAFFIC = os.path.join(os.path.dirname(__file__), 'fixtures', 'traffic.jsonl')
+
+
+class TestReplay:
+
+    def test_replay_matches_recording(self):
+        import homework
+
+        states = TenantStateTable()
+        states.add('replay', 1650000000)
+        outbox = Outbox(':memory:')
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=0)
+        scheduler.add('replay')
+        tenants = {'replay': Tenant('replay', 'token', 'replay')}
+        report = replay.Replayer(TRAFFIC).run(
+            homework.poll_round, tenants, states, outbox, scheduler, clock
+        )
+        assert report['polls'] == 6
+        assert report['sent'] == 4
+        assert report['matches_recording']
+
+    def test_recorder_is_sanitized(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(
+            requests, 'get',
+            lambda *a, **kw: MockResponse(
+                {'homeworks': [], 'current_date': 1650000600}
+            )
+        )
+        path = str(tmp_path / 'traffic.jsonl.gz')
+        bot = MockBot()
+        recorder = replay.Recorder(path)
+        recorder.install(bot)
+        requests.get(
+            url='https://practicum.yandex.ru/api/user_api/homework_statuses/',
+            headers={'Authorization': 'OAuth secret-token'},
+            params={'from_date': 1650000000}
+        )
+        bot.send_message('987654', 'Hello')
+        recorder.uninstall()
+        records = list(replay.read_records(path))
+        assert [record['kind'] for record in records] == ['api', 'send']
+        assert records[0]['params'] == {'from_date': 1650000000}
+        dump = json.dumps(records)
+        assert 'secret-token' not in dump
+        assert '987654' not in dump
+        assert bot.send_message('1', 'Bye') == 'Bye'
+        assert len(list(replay.read_records(path))) == 2
+
+    def test_multi_tenant_round_trip(self, monkeypatch, tmp_path):
+        import homework
+
+        verdicts = {'alpha': 'approved', 'beta': 'rejected'}
+
+        def upstream(*args, headers=None, **kwargs):
+            token = headers['Authorization'].split()[-1]
+            return MockResponse({
+                'homeworks': [{
+                    'id': 1,
+                    'homework_name': f'{token}.zip',
+                    'status': verdicts[token],
+                    'date_updated': '2022-04-15T06:12:40Z',
+                }],
+                'current_date': 1650000600,
+            }, chunk_size=16)
+
+        def poll_tenants(tokens, poll):
+            states = TenantStateTable()
+            clock = SimulatedClock()
+            scheduler = PollScheduler(clock, interval=0)
+            tenants = {}
+            for token in tokens:
+                tenants[token] = Tenant(token, token, token)
+                states.add(token, 1650000000)
+                scheduler.add(token)
+            outbox = Outbox(':memory:')
+            return states, poll(tenants, states, outbox, scheduler, clock)
+
+        monkeypatch.setattr(requests, 'get', upstream)
+        path = str(tmp_path / 'traffic.jsonl')
+        bot = MockBot()
+        recorder = replay.Recorder(path)
+        recorder.install(bot)
+
+        def record(*args):
+            for _ in range(2):
+                homework.poll_round(bot, *args)
+
+        poll_tenants(['alpha', 'beta'], record)
+        recorder.uninstall()
+        records = list(replay.read_records(path))
+        assert 'alpha' not in json.dumps(
+            [record.get('tenant') for record in records]
+        )
+        assert {record['kind'] for record in records} == {
+            'api', 'body', 'send'
+        }
+
+        replayer = replay.Replayer(path)
+        assert len(replayer.tenants) == 2
+        states, report = poll_tenants(
+            replayer.tenants,
+            lambda *args: replayer.run(homework.poll_round, *args)
+        )
+        assert report['polls'] == 4
+        assert report['sent'] == 2
+        assert report['matches_recording']
+        statuses = sorted(
+            states.status(states.row(key)) for key in replayer.tenants
+        )
+        assert statuses == ['approved', 'rejected']
+        alpha = replay.tenant_key({'Authorization': 'OAuth alpha'})
+        assert states.status(states.row(alpha)) == 'approved'
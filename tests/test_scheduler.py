@@ -0,0 +1,238 @@
+import threading
+from concurrent.futures import wait
+
+import requests
+
+from clock import SimulatedClock
+from outbox import Outbox
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant
+from utils import MockBot, MockResponse
+
+DAY = 24 * 60 * 60
+
+
+class TestScheduler:
+
+    def test_simulated_clock(self):
+        clock = SimulatedClock(start=100)
+        clock.sleep(50)
+        clock.sleep(-10)
+        assert clock.time() == 150
+
+    def test_pop_due_in_order(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        scheduler.add('b', delay=20)
+        scheduler.add('a', delay=10)
+        scheduler.add('c', delay=30)
+        assert scheduler.time_to_next() == 10
+        clock.sleep(25)
+        assert scheduler.pop_due() == [('a', 10), ('b', 20)]
+        assert 'a' not in scheduler
+        assert scheduler.next_due() == 30
+
+    def test_reschedule_keeps_rate_without_bursts(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        scheduler.add('a')
+        [(tenant_id, due)] = scheduler.pop_due()
+        clock.sleep(5)
+        scheduler.reschedule(tenant_id, due)
+        assert scheduler.next_due() == 60
+        clock.sleep(55)
+        [(tenant_id, due)] = scheduler.pop_due()
+        assert due == 60
+        clock.sleep(500)
+        scheduler.reschedule(tenant_id, due)
+        assert scheduler.next_due() == clock.time()
+
+    def test_remove(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        scheduler.add('a')
+        scheduler.add('b', delay=5)
+        scheduler.remove('a')
+        assert scheduler.next_due() == 5
+        clock.sleep(10)
+        assert scheduler.pop_due() == [('b', 5)]
+        assert len(scheduler) == 0
+
+    def test_poll_loop_day_on_simulated_time(self, monkeypatch):
+        import homework
+
+        clock = SimulatedClock(start=1650000000)
+        polls = []
+
+        def mock_get(*args, params=None, **kwargs):
+            polls.append(params['from_date'])
+            return MockResponse()
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        states = TenantStateTable()
+        scheduler = PollScheduler(clock, homework.RETRY_TIME)
+        tenants = {}
+        for tenant_id in ('1', '2', '3'):
+            tenants[tenant_id] = Tenant(tenant_id, 'token', tenant_id)
+            states.add(tenant_id, int(clock.time()))
+            scheduler.add(tenant_id)
+        outbox = Outbox(':memory:')
+        end = clock.time() + DAY
+        while clock.time() < end:
+            homework.poll_round(
+                MockBot(), tenants, states, outbox, scheduler, clock
+            )
+            clock.sleep(scheduler.time_to_next())
+        assert len(polls) == 3 * DAY // homework.RETRY_TIME
+        assert max(states.cursors) == end - homework.RETRY_TIME
+
+    def test_lanes_by_priority(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        scheduler.add('idle', lane='idle')
+        scheduler.add('quarantined', lane='quarantined')
+        scheduler.add('reviewing', delay=1, lane='reviewing')
+        clock.sleep(1)
+        assert [tenant for tenant, _ in scheduler.pop_due(1)] == ['reviewing']
+        assert [tenant for tenant, _ in scheduler.pop_due(1)] == ['idle']
+        assert scheduler.time_to_next() == 0
+        assert scheduler.pop_due() == [('quarantined', 0)]
+
+    def test_weighted_shares_without_starvation(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        for number in range(100):
+            scheduler.add(f'r{number}', lane='reviewing')
+            scheduler.add(f'q{number}', lane='quarantined')
+        polled = [tenant for tenant, _ in scheduler.pop_due(90)]
+        reviewing = sum(tenant.startswith('r') for tenant in polled)
+        assert reviewing == 80
+        assert [tenant for tenant in polled if tenant.startswith('q')] == [
+            f'q{number}' for number in range(10)
+        ]
+
+    def test_lag_metric_by_lane(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        before = scheduler.lag.count('active')
+        scheduler.add('a', lane='active')
+        clock.sleep(30)
+        scheduler.pop_due()
+        assert scheduler.lag.count('active') == before + 1
+
+    def test_set_lane_and_remove_ready(self):
+        clock = SimulatedClock()
+        scheduler = PollScheduler(clock, interval=60)
+        scheduler.add('a')
+        scheduler.add('b')
+        scheduler.set_lane('a', 'reviewing')
+        clock.sleep(1)
+        assert scheduler.pop_due(1) == [('a', 0)]
+        scheduler.remove('b')
+        assert 'b' not in scheduler
+        assert scheduler.pop_due() == []
+
+    def test_choose_lane(self):
+        import homework
+
+        now = 10 * DAY
+        states = TenantStateTable()
+        row = states.add('1', 0)
+        assert homework.choose_lane(states, row, now) == 'idle'
+        states.changed_at[row] = now - 60
+        assert homework.choose_lane(states, row, now) == 'active'
+        states.set_status(row, 'reviewing')
+        assert homework.choose_lane(states, row, now) == 'reviewing'
+        for _ in range(homework.QUARANTINE_FAILURES):
+            states.record_failure(row)
+        assert homework.choose_lane(states, row, now) == 'quarantined'
+
+    def test_slow_tenant_holds_only_its_worker(self, monkeypatch):
+        import homework
+        from limiter import AdaptiveLimiter
+
+        clock = SimulatedClock(start=1650000000)
+        monkeypatch.setattr(
+            homework, 'upstream_limiter',
+            AdaptiveLimiter(initial_limit=2, max_limit=2)
+        )
+        fast_polls = []
+        release = threading.Event()
+
+        def mock_get(*args, headers=None, **kwargs):
+            token = headers['Authorization'].split()[-1]
+            if token == 'slow':
+                assert release.wait(5)
+            else:
+                fast_polls.append(token)
+                if len(fast_polls) == 6:
+                    release.set()
+            return MockResponse()
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        states = TenantStateTable()
+        scheduler = PollScheduler(clock, homework.RETRY_TIME)
+        tenants = {}
+        for token in ('slow', '1', '2', '3', '4', '5', '6'):
+            tenants[token] = Tenant(token, token, token)
+            states.add(token, int(clock.time()))
+            scheduler.add(token, lane='reviewing')
+        homework.poll_round(
+            MockBot(), tenants, states, Outbox(':memory:'), scheduler, clock
+        )
+        assert release.is_set()
+        assert sorted(fast_polls) == ['1', '2', '3', '4', '5', '6']
+        assert len(scheduler.heap) == 7
+        assert scheduler.pop_due() == []
+
+    def test_round_does_not_wait_for_a_poll_past_the_deadline(
+        self, monkeypatch
+    ):
+        import homework
+        from limiter import AdaptiveLimiter
+
+        clock = SimulatedClock(start=1650000000)
+        monkeypatch.setattr(
+            homework, 'upstream_limiter',
+            AdaptiveLimiter(initial_limit=2, max_limit=2)
+        )
+        release = threading.Event()
+
+        def mock_get(*args, headers=None, **kwargs):
+            if headers['Authorization'].split()[-1] == 'slow':
+                assert release.wait(5)
+                return MockResponse()
+            clock.sleep(homework.RELOAD_INTERVAL)
+            return MockResponse({'homeworks': [{
+                'id': 1,
+                'homework_name': 'hw1',
+                'status': 'approved',
+                'date_updated': '2022-04-15T06:12:40Z',
+            }]})
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        states = TenantStateTable()
+        scheduler = PollScheduler(clock, homework.RETRY_TIME)
+        tenants = {}
+        for token in ('slow', 'fast'):
+            tenants[token] = Tenant(token, token, token)
+            states.add(token, int(clock.time()))
+            scheduler.add(token, lane='reviewing')
+        bot = MockBot()
+        outbox = Outbox(':memory:', clock)
+        try:
+            homework.poll_round(bot, tenants, states, outbox, scheduler, clock)
+            assert [chat_id for chat_id, _ in bot.sent] == ['fast']
+            assert 'fast' in scheduler
+            assert 'slow' not in scheduler
+            assert [
+                tenant_id for tenant_id, _ in homework.polls_in_flight.values()
+            ] == ['slow']
+        finally:
+            release.set()
+        wait(homework.polls_in_flight)
+        homework.poll_round(bot, tenants, states, outbox, scheduler, clock)
+        assert not homework.polls_in_flight
+        assert 'slow' in scheduler
+        assert scheduler.next_due() == 1650000000 + homework.RETRY_TIME
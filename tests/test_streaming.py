@@ -0,0 +1,93 @@
+import json
+
+import pytest
+import requests
+
+import profiling
+from my_exception import RequestError
+from streaming import HomeworkStream
+from utils import MockResponse
+
+RESPONSE = {
+    'current_date': 1650000000,
+    'homeworks': [
+        {
+            'id': number,
+            'homework_name': f'hw{number}',
+            'status': 'approved',
+            'reviewer_comment': 'Всё нравится, спасибо! ' * 5,
+        }
+        for number in range(5)
+    ],
+}
+
+
+def chunks(text, size):
+    content = text.encode()
+    return [content[start:start + size] for start in range(0, len(content), size)]
+
+
+class TestHomeworkStream:
+
+    @pytest.mark.parametrize('size', [1, 2, 5, 64, 4096])
+    def test_records_across_chunk_borders(self, size):
+        body = json.dumps(RESPONSE, ensure_ascii=False, indent=1)
+        stream = HomeworkStream(chunks(body, size))
+        assert list(stream) == RESPONSE['homeworks']
+        assert stream.extra == {'current_date': 1650000000}
+
+    def test_empty_homeworks(self):
+        stream = HomeworkStream(chunks('{"homeworks": [], "current_date": 1}', 3))
+        assert list(stream) == []
+        assert stream.extra == {'current_date': 1}
+
+    def test_records_are_lazy(self):
+        body = json.dumps(RESPONSE) + 'garbage'
+        stream = iter(HomeworkStream(chunks(body, 16)))
+        assert next(stream) == RESPONSE['homeworks'][0]
+
+    @pytest.mark.parametrize('body, error', [
+        ('[{"homeworks": []}]', TypeError),
+        ('{}', ValueError),
+        ('{"current_date": 1}', KeyError),
+        ('{"homeworks": {"status": "approved"}}', TypeError),
+        ('{"homeworks": [{"status": "approved"}', ValueError),
+    ])
+    def test_malformed_response(self, body, error):
+        with pytest.raises(error):
+            list(HomeworkStream(chunks(body, 4)))
+
+
+class TestStreamHomeworks:
+
+    def test_stages_are_timed_over_the_body(self, monkeypatch):
+        import homework
+
+        body = json.dumps(RESPONSE, ensure_ascii=False)
+        response = MockResponse(body, chunk_size=64, delay=0.01)
+        monkeypatch.setattr(requests, 'get', lambda *a, **kw: response)
+        monkeypatch.setattr(profiling, 'timers_enabled', False)
+        profiling.toggle_timers()
+        try:
+            with homework.stream_homeworks('token', 0) as homeworks:
+                assert list(homeworks) == RESPONSE['homeworks']
+        finally:
+            profiling.toggle_timers()
+        reads = len(response.chunks())
+        count, total, _ = profiling.stage_stats['get_api_answer']
+        assert count == 1
+        assert total >= reads * 0.01
+        count, total, _ = profiling.stage_stats['check_response']
+        assert count == 1
+        assert total < reads * 0.01
+        assert response.closed
+
+    def test_error_response_is_closed(self, monkeypatch):
+        import homework
+
+        response = MockResponse('{"message": "denied"}', 401)
+        monkeypatch.setattr(requests, 'get', lambda *a, **kw: response)
+        with pytest.raises(RequestError):
+            with homework.stream_homeworks('token', 0):
+                pass
+        assert response.closed
@@ -0,0 +1,50 @@
+from tenant_state import NO_FINGERPRINT, TenantStateTable, fingerprint
+
+
+class TestTenantState:
+
+    def test_fingerprint(self):
+        assert fingerprint(None) == NO_FINGERPRINT
+        assert fingerprint('approved') == fingerprint('approved')
+        assert fingerprint('approved') != fingerprint('rejected')
+        assert 0 < fingerprint('approved') < 2 ** 64
+
+    def test_add_and_update(self):
+        states = TenantStateTable()
+        row = states.add('alice', 1650000000)
+        assert states.add('alice', 0) == row
+        assert states.cursors[row] == 1650000000
+        assert states.status(row) is None
+        assert states.is_new_message(row, 'Hello')
+        states.set_status(row, 'reviewing')
+        states.set_message(row, 'Hello')
+        states.set_error(row, 'Crash')
+        assert states.status(row) == 'reviewing'
+        assert not states.is_new_message(row, 'Hello')
+        assert not states.is_new_error(row, 'Crash')
+        assert states.is_new_error(row, 'Another crash')
+
+    def test_unknown_status(self):
+        states = TenantStateTable()
+        row = states.add('alice', 0)
+        states.set_status(row, 'unknown')
+        assert states.status(row) is None
+
+    def test_removed_row_is_reused_clean(self):
+        states = TenantStateTable()
+        states.add('alice', 1)
+        row = states.add('bob', 2)
+        states.set_message(row, 'Hello')
+        states.remove('bob')
+        assert 'bob' not in states
+        assert states.add('carol', 3) == row
+        assert states.cursors[row] == 3
+        assert states.is_new_message(row, 'Hello')
+        assert len(states) == 2
+
+    def test_failures_saturate(self):
+        states = TenantStateTable()
+        row = states.add('alice', 0)
+        for _ in range(300):
+            states.record_failure(row)
+        assert states.failures[row] == 255
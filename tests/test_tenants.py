@@ -0,0 +1,77 @@
+import json
+import os
+
+from clock import SimulatedClock
+from outbox import Outbox
+from scheduler import PollScheduler
+from tenant_state import TenantStateTable
+from tenants import Tenant, TenantRegistry, diff_tenants, load_tenants
+
+
+def write_registry(path, records, mtime):
+    path.write_text(json.dumps(records))
+    os.utime(path, (mtime, mtime))
+
+
+class TestTenants:
+
+    def test_load_tenants(self, tmp_path):
+        path = tmp_path / 'tenants.json'
+        write_registry(path, [
+            {'practicum_token': 'a', 'chat_id': 1},
+            {'id': 'bob', 'practicum_token': 'b', 'chat_id': 2},
+        ], 1)
+        assert load_tenants(str(path)) == {
+            '1': Tenant('1', 'a', '1'),
+            'bob': Tenant('bob', 'b', '2'),
+        }
+
+    def test_diff_tenants(self):
+        old = {'1': Tenant('1', 'a', '1'), '2': Tenant('2', 'b', '2')}
+        new = {'2': Tenant('2', 'c', '2'), '3': Tenant('3', 'd', '3')}
+        added, removed, updated = diff_tenants(old, new)
+        assert added == [Tenant('3', 'd', '3')]
+        assert removed == ['1']
+        assert updated == [Tenant('2', 'c', '2')]
+
+    def test_registry_reloads_on_change(self, tmp_path):
+        path = tmp_path / 'tenants.json'
+        write_registry(path, [{'practicum_token': 'a', 'chat_id': 1}], 1)
+        registry = TenantRegistry(str(path))
+        assert list(registry.check()) == ['1']
+        assert registry.check() is None
+        registry.request_reload()
+        assert list(registry.check()) == ['1']
+        write_registry(path, [{'practicum_token': 'b', 'chat_id': 2}], 2)
+        assert list(registry.check()) == ['2']
+        path.write_text('[{"chat_id": ')
+        os.utime(path, (3, 3))
+        assert registry.check() is None
+
+    def test_apply_tenants_keeps_state(self):
+        import homework
+
+        clock = SimulatedClock(start=10000)
+        tenants = {}
+        states = TenantStateTable()
+        outbox = Outbox(':memory:')
+        outbox.enqueue('3', '3', [], 5000)
+        scheduler = PollScheduler(clock, homework.RETRY_TIME)
+        homework.apply_tenants(
+            {'1': Tenant('1', 'a', '1'), '2': Tenant('2', 'b', '2')},
+            tenants, states, outbox, scheduler, clock
+        )
+        row = states.row('1')
+        states.cursors[row] = 9999
+        states.set_message(row, 'Hello')
+        homework.apply_tenants(
+            {'1': Tenant('1', 'new', '1'), '3': Tenant('3', 'c', '3')},
+            tenants, states, outbox, scheduler, clock
+        )
+        assert tenants['1'].practicum_token == 'new'
+        assert '2' not in tenants and '2' not in states
+        assert '2' not in scheduler
+        assert states.row('1') == row
+        assert states.cursors[row] == 9999
+        assert not states.is_new_message(row, 'Hello')
+        assert states.cursors[states.row('3')] == 5000
@@ -1,3 +1,6 @@
+import json
+import time
+from http import HTTPStatus
 from inspect import signature
 from types import ModuleType
 
@@ -37,3 +40,51 @@ def check_default_var_exists(scope: ModuleType, var_name: str) -> None:
         f'{var_name} должна быть переменной, а не функцией.'
     )
 
+
+class MockResponse:
+    """Homework API response streaming its body in chunks of chunk_size."""
+
+    def __init__(self, body=None, status_code=HTTPStatus.OK,
+                 chunk_size=None, delay=0.0):
+        if body is None:
+            body = {'homeworks': []}
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        self.text = body
+        self.status_code = status_code
+        self.reason = HTTPStatus(status_code).phrase
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.text)
+
+    def chunks(self):
+        """Body chunks in the order iter_content yields them."""
+        content = self.text.encode()
+        size = self.chunk_size or len(content) or 1
+        return [
+            content[start:start + size]
+            for start in range(0, len(content), size)
+        ]
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.chunks():
+            if self.delay:
+                time.sleep(self.delay)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class MockBot:
+    """Telegram bot keeping the sent messages as (chat_id, text) pairs."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        self.sent.append((chat_id, text))
+        return text